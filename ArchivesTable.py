@@ -1,60 +1,51 @@
-import json
 import os
-from os.path import exists
 
-import boto3
 from PyQt6 import QtWidgets, uic
-from PyQt6.QtCore import QSize
-from PyQt6.QtGui import QStandardItem, QStandardItemModel
+from PyQt6.QtCore import QSize, QTimer, Qt
 from PyQt6.QtWidgets import QMessageBox
 
-CREDENTIALS = {
-    'access_key_id': 'access-key-id',
-    'secret_access_key': 'secret-access-key',
-    'vault_name': 'name',
-    'account_id': 'id',
-    'bucket': 'bucket-name'
-}
+from ArchivesTableModel import ArchivesTableModel
+from MetricsStatusLabel import MetricsStatusLabel
+from retrieval_scheduler import RETRIEVAL_SETTINGS, RETRIEVAL_TIERS
+from task_scheduler import PRIORITY_HIGH, PRIORITY_LOW
 
 basedir = os.path.dirname(__file__)
 
 
 class ArchivesTable(QtWidgets.QMainWindow):
 
-    def __init__(self, glacier_resource, vault, main_window):
+    def __init__(self, main_window, archive_service, scheduler):
         super(ArchivesTable, self).__init__(parent=main_window)
         self.main_window = main_window
         self.loadUi()
-        self.glacier_resource = glacier_resource
-        self.s3 = boto3.resource('s3',
-                                 aws_access_key_id=CREDENTIALS['access_key_id'],
-                                 aws_secret_access_key=CREDENTIALS['secret_access_key'])
-        self.vault = vault
-        self.jobs = self.vault.jobs.all()
+        self.archive_service = archive_service
+        self.catalog = archive_service.catalog
+        self.scheduler = scheduler
+        self.scheduler.queue_changed.connect(self.show_queue_status)
+        self.job_cache = archive_service.job_cache
+        self.retrieval_scheduler = archive_service.retrieval_scheduler
+        self.retrieval_task = None
+        self.schedule_job_cache_refresh()
+        self.job_cache_timer = QTimer(self)
+        self.job_cache_timer.timeout.connect(self.schedule_job_cache_refresh)
+        self.job_cache_timer.timeout.connect(self.schedule_retrieval_run)
+        self.job_cache_timer.start(self.job_cache.refresh_interval * 1000)
         self.setWindowTitle('Archives Table')
+        self.metrics_label = MetricsStatusLabel(self.statusbar)
 
-        path_to_archives_json = os.path.join(basedir, 'storage/archives.json')
-        if not exists(path_to_archives_json):
-            bucket = self.s3.Bucket(CREDENTIALS['bucket'])
-            bucket.download_file('archives.json', path_to_archives_json)
-
-        if os.stat(path_to_archives_json).st_size != 0:
-            with open(path_to_archives_json, 'r') as archives:
-                try:
-                    archives_list = json.load(archives)
-                except:
-                    print('invalid json format')
-                    archives_list = []
-        else:
-            archives_list = []
+        self.main_window.schedule_catalog_load(on_done=lambda _: self.update_table())
 
-        self.item_model = QStandardItemModel(self)
-        self.item_model.setHorizontalHeaderLabels(['ID', 'Description'])
-        for archive in archives_list:
-            if archive:
-                self.item_model.appendRow([QStandardItem(archive['id']), QStandardItem(archive['description'])])
+        self.item_model = ArchivesTableModel(self.catalog, self)
         self.archives_table.setModel(self.item_model)
+        self.archives_table.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.archives_table.setSortingEnabled(True)
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(300)
+        self.filter_timer.timeout.connect(lambda: self.item_model.set_filter(self.archives_filter_edit.text()))
+        self.archives_filter_edit.textChanged.connect(self.filter_timer.start)
         self.archives_table.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.MultiSelection)
+        self.archives_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectionBehavior.SelectRows)
         self.archives_table.verticalHeader().hide()
         hh = self.archives_table.horizontalHeader()
         vh = self.archives_table.verticalHeader()
@@ -62,112 +53,150 @@ class ArchivesTable(QtWidgets.QMainWindow):
         self.setMinimumSize(size)
         self.archives_delete_btn.clicked.connect(self.on_button_pressed)
         self.archives_download_btn.clicked.connect(self.on_button_pressed)
+        # Retrievals queued in an earlier session carry on in the background.
+        self.schedule_retrieval_run()
 
     def loadUi(self):
         uic.loadUi(os.path.join(basedir, 'storage/ui/archives_table.ui'), self)
 
     def update_table(self):
-        if self.item_model.rowCount():
-            self.item_model.setRowCount(0)
-            self.item_model.setColumnCount(0)
+        self.item_model.reload()
+
+    def add_table_rows(self, archive_array):
+        self.item_model.add_archives(archive_array)
+
+    def schedule_job_cache_refresh(self):
+        self.scheduler.submit('jobs', lambda task: self.job_cache.refresh(), priority=PRIORITY_LOW,
+                              title='Refresh retrieval jobs', on_error=self.show_task_error)
+
+    def show_queue_status(self, running_count, queued_count):
+        if running_count or queued_count:
+            self.statusbar.showMessage(f'{running_count} task(s) running, {queued_count} queued')
         else:
-            self.item_model.removeRow(0)
-            self.item_model.removeColumn(0)
-        with open(os.path.join(basedir, 'storage/archives.json'), 'r') as archives:
-            archives_list = json.load(archives)
-        self.item_model.setHorizontalHeaderLabels(['ID', 'Description'])
-        for archive in archives_list:
-            if archive:
-                self.item_model.appendRow([QStandardItem(archive['id']), QStandardItem(archive['description'])])
-
-    def start_archive_retrieval_job(self, archive_id):
-        self.glacier_resource.Archive(CREDENTIALS['account_id'], CREDENTIALS['vault_name'],
-                                      archive_id).initiate_archive_retrieval()
+            self.statusbar.clearMessage()
+
+    def show_task_error(self, error):
+        QMessageBox.question(self,
+                             'Something went wrong',
+                             str(error),
+                             QMessageBox.StandardButton.Ok,
+                             QMessageBox.StandardButton.Ok)
+
+    def start_archive_retrieval_job(self, archive_id, tier=None):
+        self.start_archive_retrieval_jobs([archive_id], tier)
+
+    def start_archive_retrieval_jobs(self, archive_ids, tier=None):
+        queued_count, coalesced_count = self.archive_service.request_retrievals(archive_ids, tier)
+        self.statusbar.showMessage(f'{queued_count} retrieval(s) queued, {coalesced_count} already requested')
+        self.schedule_retrieval_run()
+
+    def schedule_retrieval_run(self):
+        if self.retrieval_task is not None or not self.retrieval_scheduler.pending_count():
+            return
+        self.retrieval_task = self.scheduler.submit('retrieval',
+                                                    lambda task: self.retrieval_scheduler.run(task.report_progress,
+                                                                                              task.cancel_event),
+                                                    priority=PRIORITY_HIGH,
+                                                    title='Start queued retrievals',
+                                                    on_done=self.on_retrieval_run_finished,
+                                                    on_error=self.on_retrieval_run_failed)
+
+    def on_retrieval_run_finished(self, results):
+        self.retrieval_task = None
+        started_count, failed = results
+        self.statusbar.showMessage(f'Started {started_count} retrieval job(s)')
+        if failed:
+            QMessageBox.question(self,
+                                 'Some retrievals were not started',
+                                 f'{len(failed)} archive retrievals could not be started:\n' +
+                                 '\n'.join(f'{archive_id}: {error}' for archive_id, error in list(failed.items())[:10]),
+                                 QMessageBox.StandardButton.Ok,
+                                 QMessageBox.StandardButton.Ok)
+        # Requests queued while the run was finishing are picked up by a new run.
+        self.schedule_retrieval_run()
+
+    def on_retrieval_run_failed(self, error):
+        self.retrieval_task = None
+        self.show_task_error(error)
+
+    def ask_retrieval_tier(self, archive_count):
+        tier, ok = QtWidgets.QInputDialog.getItem(self, 'Retrieval tier',
+                                                  f'Retrieval speed for {archive_count} archive(s) '
+                                                  '(Expedited: minutes, Standard: 3-5 hours, Bulk: 5-12 hours):',
+                                                  RETRIEVAL_TIERS,
+                                                  RETRIEVAL_TIERS.index(RETRIEVAL_SETTINGS['default_tier']), False)
+        return tier if ok else None
 
     def get_archive_extension_and_description(self, archive_id):
-        archives_json = open(os.path.join(basedir, 'storage/archives.json'), 'r')
-        archive_list = json.load(archives_json)
-        for archive in archive_list:
-            if archive['id'] == archive_id:
-                archive_file_extension = archive['extension']
-                archive_description = archive['description']
-                return archive_file_extension, archive_description
-        return None, ''
+        archive = self.catalog.get(archive_id)
+        if archive is None:
+            return None, ''
+        return archive['extension'], archive['description']
 
     def remove_archive(self, archive_id):
-        account_id = CREDENTIALS['account_id']
-        vault_name = CREDENTIALS['vault_name']
-        archive = self.glacier_resource.Archive(account_id, vault_name, archive_id)
-        response = archive.delete()
-        with open(os.path.join(basedir, 'storage/logs/deleted_archive_response_log.txt'), 'a') as delete_log:
-            json_formatted_output = json.dumps(response, indent=4, sort_keys=True)
-            delete_log.write(json_formatted_output)
-        with open(os.path.join(basedir, 'storage/archives.json'), 'r') as archives_json:
-            archive_list = json.load(archives_json)
-            new_archive_list = []
-            for archive in archive_list:
-                if archive['id'] == archive_id:
-                    del archive
-                else:
-                    new_archive_list.append({'id': archive['id'], 'description': archive['description'], "extension": archive['extension'], "size": archive['size']})
-        with open(os.path.join(basedir, 'storage/archives.json'), 'w') as archives:
-            json.dump(new_archive_list, archives)
-        response = self.s3.Bucket(CREDENTIALS['bucket']).upload_file(os.path.join(basedir, 'storage/archives.json'), 'archives.json')
-        with open(os.path.join(basedir, f'storage/logs/replaced_file_of_bucket_{CREDENTIALS["bucket"]}_response_log.txt'), 'a') as delete_log:
-            json_formatted_output = json.dumps(response, indent=4, sort_keys=True)
-            delete_log.write(json_formatted_output)
-        self.update_table()
+        return self.remove_archives([archive_id])
+
+    def remove_archives(self, archive_ids):
+        vault_ids, pack_members, kept_members = self.archive_service.plan_delete(archive_ids)
+        self.scheduler.submit('delete', self.delete_archives_from_vault, vault_ids,
+                              title=f'Delete {len(archive_ids)} archive(s)',
+                              on_done=lambda results: self.on_archives_deleted(results, pack_members, kept_members),
+                              on_error=self.show_task_error)
+
+    def delete_archives_from_vault(self, task, archive_ids):
+        return self.archive_service.delete_archives_from_vault(archive_ids, task.report_progress)
+
+    def on_archives_deleted(self, results, pack_members=None, kept_members=None):
+        responses, failed = results
+        removed_ids, failed = self.archive_service.remove_deleted_archives(responses, failed, pack_members or {},
+                                                                           kept_members or [])
+        if removed_ids:
+            self.main_window.schedule_catalog_sync()
+            self.remove_table_rows(removed_ids)
+        if failed:
+            QMessageBox.question(self,
+                                 'Some archives were not deleted',
+                                 f'{len(failed)} of {len(responses) + len(failed)} archives could not be deleted. Check the delete log for details.',
+                                 QMessageBox.StandardButton.Ok,
+                                 QMessageBox.StandardButton.Ok)
+
+    def remove_table_rows(self, archive_ids):
+        self.item_model.remove_archives(archive_ids)
 
     def download_archive_retrieval_output(self, archive_id, path=None):
-        retrieval_job = None
-        archive_file_extension, archive_description = self.get_archive_extension_and_description(archive_id)
-        if not path:
-            if archive_description == '':
-                path = os.path.join(basedir, 'storage/output/') + archive_id
-            else:
-                path = os.path.join(basedir, 'storage/output/') + archive_description
-        if os.path.splitext(path)[1] == '':
-            filename = path + archive_file_extension
-        else:
-            filename = path
-        for job in self.jobs:
-            if job.archive_id == archive_id:
-                retrieval_job = job
-                break
-        archive_output = retrieval_job.get_output()
-        with open(filename, 'wb') as archive_output_file_raw:
-            output_raw = archive_output['body'].read()
-            archive_output_file_raw.write(output_raw)
+        filename = self.archive_service.output_filename(archive_id, path)
+        self.scheduler.submit('download', self.download_job_output, archive_id, filename,
+                              title=f'Download {os.path.basename(filename)}',
+                              on_done=lambda _: self.statusbar.showMessage(f'Downloaded {filename}'),
+                              on_error=self.show_task_error)
+
+    def download_job_output(self, task, archive_id, filename):
+        return self.archive_service.download_archive(archive_id, filename, task.report_progress)
 
     def archive_retrieval_status(self, archive_id):
-        for job in self.jobs:
-            if job.archive_id == archive_id:
-                return job.completed, True
-        return False, False
+        return self.archive_service.retrieval_status(archive_id)
 
     def on_button_pressed(self):
         button_id = self.sender().objectName()
+        rows = sorted(set(x.row() for x in self.archives_table.selectedIndexes()))
 
         if button_id == self.archives_download_btn.objectName():
 
-            if len(self.archives_table.selectedIndexes()) == 1:
-                row = [self.archives_table.selectedIndexes()[0].row()]
-                archive_id = self.item_model.index(row[0], 0).data()
+            if len(rows) == 1:
+                archive_id = self.item_model.archive_id(rows[0])
                 self.handle_single_archive_download_request(archive_id)
 
-            elif len(self.archives_table.selectedIndexes()) > 1:
-                rows = [x.row() for x in self.archives_table.selectedIndexes()]
+            elif len(rows) > 1:
                 archive_ids = []
                 for row in rows:
-                    archive_id = self.item_model.index(row, 0).data()
+                    archive_id = self.item_model.archive_id(row)
                     archive_ids.append(archive_id)
                 self.handle_multi_archive_download_request(archive_ids)
 
         elif button_id == self.archives_delete_btn.objectName():
 
-            if len(self.archives_table.selectedIndexes()) == 1:
-                row = [self.archives_table.selectedIndexes()[0].row()]
-                archive_id = self.item_model.index(row[0], 0).data()
+            if len(rows) == 1:
+                archive_id = self.item_model.archive_id(rows[0])
                 confirmation = QMessageBox.question(self,
                                                     'Delete Archive',
                                                     'You are about to delete an archive. Are you sure you want to continue',
@@ -175,17 +204,15 @@ class ArchivesTable(QtWidgets.QMainWindow):
                                                     QMessageBox.StandardButton.Cancel)
                 if confirmation == QMessageBox.StandardButton.Yes:
                     self.remove_archive(archive_id)
-            elif len(self.archives_table.selectedIndexes()) > 1:
-                rows = [x.row() for x in self.archives_table.selectedIndexes()]
+            elif len(rows) > 1:
                 confirmation = QMessageBox.question(self,
                                                     'Delete Archive',
                                                     'You are about to delete multiple archives. Are you sure you want to continue',
                                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.Cancel,
                                                     QMessageBox.StandardButton.Cancel)
                 if confirmation == QMessageBox.StandardButton.Yes:
-                    for row in rows:
-                        archive_id = self.item_model.index(row, 0).data()
-                        self.remove_archive(archive_id)
+                    archive_ids = [self.item_model.archive_id(row) for row in rows]
+                    self.remove_archives(archive_ids)
 
     def handle_single_archive_download_request(self, archive_id):
         retrieval_completed, retrieval_started = self.archive_retrieval_status(archive_id)
@@ -196,7 +223,9 @@ class ArchivesTable(QtWidgets.QMainWindow):
                                                 QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.Cancel,
                                                 QMessageBox.StandardButton.Cancel)
             if confirmation == QMessageBox.StandardButton.Yes:
-                self.start_archive_retrieval_job(archive_id)
+                tier = self.ask_retrieval_tier(1)
+                if tier:
+                    self.start_archive_retrieval_job(archive_id, tier)
         elif retrieval_completed:
             confirmation = QMessageBox.question(self,
                                                 'Download Archive',
@@ -271,5 +300,7 @@ class ArchivesTable(QtWidgets.QMainWindow):
             # if file_name[0] != '':
             for archive in archives_with_completed_jobs:
                 self.download_archive_retrieval_output(archive)
-            for archive in archives_with_not_started_jobs:
-                self.start_archive_retrieval_job(archive)
+            if archives_with_not_started_jobs:
+                tier = self.ask_retrieval_tier(len(archives_with_not_started_jobs))
+                if tier:
+                    self.start_archive_retrieval_jobs(archives_with_not_started_jobs, tier)
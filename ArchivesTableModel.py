@@ -0,0 +1,142 @@
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+COLUMNS = [
+    ('ID', 'id'),
+    ('Description', 'description'),
+    ('Size', 'size_in_bytes'),
+    ('Date', 'creation_date')
+]
+
+FETCH_SIZE = 500
+
+
+def format_size(size_in_bytes, size):
+    if size_in_bytes is None:
+        return size
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size_in_bytes < 1024:
+            return f'{size_in_bytes:.1f} {unit}' if unit != 'B' else f'{size_in_bytes} B'
+        size_in_bytes /= 1024
+    return f'{size_in_bytes:.1f} TB'
+
+
+class ArchivesTableModel(QAbstractTableModel):
+
+    def __init__(self, catalog, parent=None):
+        super(ArchivesTableModel, self).__init__(parent)
+        self.catalog = catalog
+        self.sort_column = 'rowid'
+        self.descending = False
+        self.filter_text = ''
+        # Loaded rows are kept as one list per column instead of one item object per cell.
+        self.ids = []
+        self.descriptions = []
+        self.sizes = []
+        self.sizes_in_bytes = []
+        self.creation_dates = []
+        # The (sort value, rowid) of the last loaded row, where the next page continues.
+        self.last_key = None
+        self.total = self.catalog.count()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        row = index.row()
+        column = index.column()
+        if column == 0:
+            return self.ids[row]
+        if column == 1:
+            return self.descriptions[row]
+        if column == 2:
+            return format_size(self.sizes_in_bytes[row], self.sizes[row])
+        return self.creation_dates[row] or ''
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return COLUMNS[section][0]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and len(self.ids) < self.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        archives = self.catalog.page(FETCH_SIZE, self.sort_column, self.descending, self.filter_text, self.last_key)
+        if not archives:
+            self.total = len(self.ids)
+            return
+        self.last_key = (archives[-1][self.sort_column], archives[-1]['rowid'])
+        self.beginInsertRows(QModelIndex(), len(self.ids), len(self.ids) + len(archives) - 1)
+        self.append_columns(archives)
+        self.endInsertRows()
+
+    def append_columns(self, archives):
+        for archive in archives:
+            self.ids.append(archive['id'])
+            self.descriptions.append(archive['description'])
+            self.sizes.append(archive['size'])
+            self.sizes_in_bytes.append(archive['size_in_bytes'])
+            self.creation_dates.append(archive['creation_date'])
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.sort_column = COLUMNS[column][1] if 0 <= column < len(COLUMNS) else 'rowid'
+        self.descending = order == Qt.SortOrder.DescendingOrder
+        self.reload()
+
+    def set_filter(self, filter_text):
+        self.filter_text = filter_text
+        self.reload()
+
+    def reload(self):
+        self.beginResetModel()
+        for column in [self.ids, self.descriptions, self.sizes, self.sizes_in_bytes, self.creation_dates]:
+            column.clear()
+        self.last_key = None
+        self.total = self.catalog.count(self.filter_text)
+        self.endResetModel()
+
+    def archive_id(self, row):
+        return self.ids[row]
+
+    def add_archives(self, archives):
+        # New catalog rows sort last by default, so they can be appended once everything before them is loaded.
+        if self.sort_column != 'rowid' or self.descending or self.filter_text:
+            self.reload()
+            return
+        if self.canFetchMore():
+            self.total = self.catalog.count()
+            return
+        archives = [archive for archive in archives if archive and archive.get('id') and not archive.get('is_pack')]
+        loaded_ids = set(archive['id'] for archive in archives) & set(self.ids)
+        if loaded_ids:
+            self.remove_archives(loaded_ids)
+            archives = [self.catalog.get(archive['id']) or archive for archive in archives]
+        if not archives:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.ids), len(self.ids) + len(archives) - 1)
+        self.append_columns(self.catalog.row_values(archive) for archive in archives)
+        self.endInsertRows()
+        self.last_key = (None, self.catalog.max_rowid())
+        self.total = len(self.ids)
+
+    def remove_archives(self, archive_ids):
+        archive_ids = set(archive_ids)
+        removed_rows = [row for row, archive_id in enumerate(self.ids) if archive_id in archive_ids]
+        # Contiguous rows are removed together, from the bottom up so earlier row numbers stay valid.
+        while removed_rows:
+            last = removed_rows.pop()
+            first = last
+            while removed_rows and removed_rows[-1] == first - 1:
+                first = removed_rows.pop()
+            self.beginRemoveRows(QModelIndex(), first, last)
+            for column in [self.ids, self.descriptions, self.sizes, self.sizes_in_bytes, self.creation_dates]:
+                del column[first:last + 1]
+            self.endRemoveRows()
+        self.total = self.catalog.count(self.filter_text)
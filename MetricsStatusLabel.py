@@ -0,0 +1,30 @@
+import time
+
+from PyQt6 import QtWidgets
+from PyQt6.QtCore import QTimer
+
+import metrics
+
+UPDATE_INTERVAL_MS = 2000
+
+
+class MetricsStatusLabel(QtWidgets.QLabel):
+
+    def __init__(self, statusbar):
+        super(MetricsStatusLabel, self).__init__(statusbar)
+        # A permanent widget stays visible next to the task messages the windows show in the same status bar.
+        statusbar.addPermanentWidget(self)
+        self.last_bytes = metrics.registry.totals()['bytes']
+        self.last_update = time.monotonic()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update_summary)
+        self.timer.start(UPDATE_INTERVAL_MS)
+        self.update_summary()
+
+    def update_summary(self):
+        now = time.monotonic()
+        total_bytes = metrics.registry.totals()['bytes']
+        bytes_per_second = (total_bytes - self.last_bytes) / (now - self.last_update) if now > self.last_update else 0
+        self.last_bytes = total_bytes
+        self.last_update = now
+        self.setText(metrics.registry.summary_text(bytes_per_second))
@@ -0,0 +1,50 @@
+import os
+
+from PyQt6 import QtWidgets, uic
+
+from MetricsStatusLabel import MetricsStatusLabel
+
+basedir = os.path.dirname(__file__)
+
+
+class ProgressWindow(QtWidgets.QMainWindow):
+
+    def __init__(self, scheduler, main_window):
+        super(ProgressWindow, self).__init__(parent=main_window)
+        self.loadUi()
+        self.setWindowTitle('Archive upload progress')
+        self.metrics_label = MetricsStatusLabel(self.statusbar)
+        self.scheduler = scheduler
+        self.tracked_tasks = {}
+        self.archive_upload_progress_bar.setRange(0, 1000)
+        self.archive_upload_progress_bar.setValue(0)
+        self.scheduler.progress.connect(self.on_progress)
+        self.scheduler.finished.connect(self.on_task_ended)
+        self.scheduler.failed.connect(self.on_task_ended)
+
+    def loadUi(self):
+        uic.loadUi(os.path.join(basedir, 'storage/ui/archive_upload_progress_window.ui'), self)
+
+    def track(self, task, total_bytes):
+        self.tracked_tasks[task.id] = [0, total_bytes]
+        self.update_progress()
+        self.show()
+
+    def on_progress(self, task_id, done, total):
+        if task_id in self.tracked_tasks:
+            self.tracked_tasks[task_id] = [done, total]
+            self.update_progress()
+
+    def on_task_ended(self, task_id, _):
+        if self.tracked_tasks.pop(task_id, None) is not None:
+            self.update_progress()
+            if not self.tracked_tasks:
+                self.hide()
+
+    def update_progress(self):
+        done = sum(progress[0] for progress in self.tracked_tasks.values())
+        total = sum(progress[1] for progress in self.tracked_tasks.values())
+        self.archive_upload_progress_bar.setValue(int(done * 1000 / total) if total else 0)
+        self.archive_upload_progress_label.setText(f'Uploading {len(self.tracked_tasks)} file(s): '
+                                                   f'{done/(1024 * 1024):.1f} of {total/(1024 * 1024):.1f} MB')
+        self.statusbar.showMessage(f'{len(self.scheduler.tasks)} task(s) queued or running')
@@ -0,0 +1,349 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Each entry upgrades the schema by one version, the current version is kept in PRAGMA user_version.
+SCHEMA_MIGRATIONS = [
+    """
+    CREATE TABLE archives (
+        id TEXT PRIMARY KEY,
+        description TEXT NOT NULL DEFAULT '',
+        extension TEXT NOT NULL DEFAULT '',
+        size TEXT NOT NULL DEFAULT ''
+    )
+    """,
+    """
+    ALTER TABLE archives ADD COLUMN size_in_bytes INTEGER;
+    ALTER TABLE archives ADD COLUMN creation_date TEXT
+    """,
+    """
+    CREATE INDEX archives_description ON archives (description);
+    CREATE INDEX archives_size_in_bytes ON archives (size_in_bytes);
+    CREATE INDEX archives_creation_date ON archives (creation_date)
+    """,
+    """
+    CREATE TABLE journal (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        operation TEXT NOT NULL,
+        archive_id TEXT NOT NULL,
+        archive TEXT
+    );
+    CREATE TABLE sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """,
+    """
+    ALTER TABLE archives ADD COLUMN pack_id TEXT;
+    ALTER TABLE archives ADD COLUMN pack_offset INTEGER;
+    ALTER TABLE archives ADD COLUMN pack_length INTEGER;
+    ALTER TABLE archives ADD COLUMN is_pack INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX archives_pack_id ON archives (pack_id)
+    """,
+    """
+    ALTER TABLE archives ADD COLUMN sha256_tree_hash TEXT;
+    CREATE INDEX archives_sha256_tree_hash ON archives (sha256_tree_hash)
+    """,
+    """
+    CREATE TABLE retrieval_queue (
+        archive_id TEXT NOT NULL,
+        byte_range TEXT NOT NULL DEFAULT '',
+        tier TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        requested_at REAL NOT NULL,
+        not_before REAL NOT NULL DEFAULT 0,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        PRIMARY KEY (archive_id, byte_range)
+    )
+    """,
+]
+
+ARCHIVE_COLUMNS = {
+    'id': '',
+    'description': '',
+    'extension': '',
+    'size': '',
+    'size_in_bytes': None,
+    'creation_date': None,
+    'pack_id': None,
+    'pack_offset': None,
+    'pack_length': None,
+    'is_pack': 0,
+    'sha256_tree_hash': None
+}
+
+SORTABLE_COLUMNS = ['rowid', 'id', 'description', 'size_in_bytes', 'creation_date']
+
+INSERT_ARCHIVE = (f'INSERT OR REPLACE INTO archives ({", ".join(ARCHIVE_COLUMNS)}) '
+                  f'VALUES ({", ".join(":" + column for column in ARCHIVE_COLUMNS)})')
+
+# Vault data from the inventory wins, but descriptions and extensions entered locally are kept.
+MERGE_ARCHIVE = (f'INSERT INTO archives ({", ".join(ARCHIVE_COLUMNS)}) '
+                 f'VALUES ({", ".join(":" + column for column in ARCHIVE_COLUMNS)}) '
+                 'ON CONFLICT(id) DO UPDATE SET '
+                 'size_in_bytes = excluded.size_in_bytes, '
+                 'creation_date = excluded.creation_date, '
+                 'sha256_tree_hash = COALESCE(excluded.sha256_tree_hash, archives.sha256_tree_hash), '
+                 "description = CASE WHEN archives.description = '' THEN excluded.description ELSE archives.description END, "
+                 "size = CASE WHEN archives.size = '' THEN excluded.size ELSE archives.size END "
+                 # Rows the inventory has nothing new for are left alone, so they are not journaled again.
+                 'WHERE archives.size_in_bytes IS NOT excluded.size_in_bytes '
+                 'OR archives.creation_date IS NOT excluded.creation_date '
+                 'OR archives.sha256_tree_hash IS NOT COALESCE(excluded.sha256_tree_hash, archives.sha256_tree_hash) '
+                 "OR (archives.description = '' AND excluded.description != '') "
+                 "OR (archives.size = '' AND excluded.size != '')")
+
+
+class ArchiveCatalog:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        # WAL with full syncs keeps the catalog consistent and durable if the app dies mid-write.
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.migrate()
+
+    def migrate(self):
+        with self.transaction() as cursor:
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            for migration in SCHEMA_MIGRATIONS[version:]:
+                for statement in migration.split(';'):
+                    if statement.strip():
+                        cursor.execute(statement)
+            cursor.execute(f'PRAGMA user_version = {len(SCHEMA_MIGRATIONS)}')
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            else:
+                cursor.execute('COMMIT')
+            finally:
+                cursor.close()
+
+    def get(self, archive_id):
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM archives WHERE id = ?', (archive_id,)).fetchone()
+        return dict(row) if row else None
+
+    def all(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT * FROM archives ORDER BY rowid').fetchall()
+        return [dict(row) for row in rows]
+
+    def max_rowid(self):
+        with self.lock:
+            return self.connection.execute('SELECT MAX(rowid) FROM archives').fetchone()[0] or 0
+
+    def count(self, filter_text=''):
+        where, parameters = self.filter_clause(filter_text)
+        with self.lock:
+            return self.connection.execute(f'SELECT COUNT(*) FROM archives {where}', parameters).fetchone()[0]
+
+    def page(self, limit, sort_column='rowid', descending=False, filter_text='', after=None):
+        # Pages continue from the (sort value, rowid) key of the last loaded row, so deep pages cost as much as the first.
+        if sort_column not in SORTABLE_COLUMNS:
+            raise ValueError(f'Cannot sort archives by {sort_column}')
+        where, parameters = self.filter_clause(filter_text)
+        direction = 'DESC' if descending else 'ASC'
+        rows = []
+        with self.lock:
+            for condition, condition_parameters in self.keyset_clauses(sort_column, descending, after):
+                if len(rows) == limit:
+                    break
+                rows += self.connection.execute(f'SELECT rowid, * FROM archives {where} AND ({condition}) '
+                                                f'ORDER BY {sort_column} {direction}, rowid {direction} LIMIT ?',
+                                                parameters + condition_parameters + [limit - len(rows)]).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def keyset_clauses(sort_column, descending, after):
+        # NULLs sort first ascending and last descending. They are paged by a separate query, because a row value
+        # holding one never compares true and an OR across both would keep the index from seeking to the key.
+        if after is None:
+            return [('1', [])]
+        operator = '<' if descending else '>'
+        value, rowid = after
+        if sort_column == 'rowid':
+            return [(f'rowid {operator} ?', [rowid])]
+        if value is None:
+            null_rows = (f'{sort_column} IS NULL AND rowid {operator} ?', [rowid])
+            return [null_rows] if descending else [null_rows, (f'{sort_column} IS NOT NULL', [])]
+        value_rows = (f'({sort_column}, rowid) {operator} (?, ?)', [value, rowid])
+        return [value_rows, (f'{sort_column} IS NULL', [])] if descending else [value_rows]
+
+    @staticmethod
+    def filter_clause(filter_text):
+        # Pack archives are only containers, their members are listed instead.
+        if not filter_text:
+            return 'WHERE is_pack = 0', []
+        pattern = '%' + filter_text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return "WHERE is_pack = 0 AND (id LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\')", [pattern, pattern]
+
+    def pack_members(self, pack_id):
+        with self.lock:
+            rows = self.connection.execute('SELECT id FROM archives WHERE pack_id = ?', (pack_id,)).fetchall()
+        return [row['id'] for row in rows]
+
+    def find_by_tree_hash(self, tree_hash, size_in_bytes=None):
+        with self.lock:
+            rows = self.connection.execute('SELECT * FROM archives WHERE sha256_tree_hash = ?', (tree_hash,)).fetchall()
+        for row in rows:
+            if size_in_bytes is None or row['size_in_bytes'] in [None, size_in_bytes]:
+                return dict(row)
+        return None
+
+    def missing_tree_hash_count(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM archives '
+                                           'WHERE sha256_tree_hash IS NULL AND pack_id IS NULL').fetchone()[0]
+
+    def set_tree_hashes(self, tree_hashes):
+        # Hashes only fill in archives the catalog already has, so an old inventory cannot bring back deleted ones.
+        with self.transaction() as cursor:
+            cursor.executemany('UPDATE archives SET sha256_tree_hash = ? WHERE id = ? AND sha256_tree_hash IS NULL',
+                               [(tree_hash, archive_id) for archive_id, tree_hash in tree_hashes])
+            return cursor.rowcount
+
+    def add(self, archive_array):
+        entries = [archive for archive in archive_array if archive and archive.get('id')]
+        self.apply([('add', archive['id'], self.row_values(archive)) for archive in entries])
+        return entries
+
+    def upsert_inventory(self, archive_array):
+        self.apply([('merge', archive['id'], self.row_values(archive)) for archive in archive_array])
+
+    @staticmethod
+    def row_values(archive):
+        return {column: default if archive.get(column) is None else archive[column]
+                for column, default in ARCHIVE_COLUMNS.items()}
+
+    def remove(self, archive_ids):
+        self.apply([('remove', archive_id, None) for archive_id in archive_ids])
+
+    def apply(self, entries, journal=True):
+        # Local changes are journaled so they can be shipped to S3, changes pulled from S3 are not.
+        with self.transaction() as cursor:
+            changed_entries = self.apply_entries(cursor, entries)
+            if journal:
+                cursor.executemany('INSERT INTO journal (operation, archive_id, archive) VALUES (?, ?, ?)',
+                                   [(operation, archive_id, json.dumps(archive) if archive is not None else None)
+                                    for operation, archive_id, archive in changed_entries])
+
+    @staticmethod
+    def apply_entries(cursor, entries):
+        # Returns the entries that changed the catalog, merges of rows that are already up to date are left out.
+        changed_entries = []
+        for operation, archive_id, archive in entries:
+            if operation == 'add':
+                cursor.execute(INSERT_ARCHIVE, archive)
+            elif operation == 'merge':
+                cursor.execute(MERGE_ARCHIVE, archive)
+                if cursor.rowcount == 0:
+                    continue
+            elif operation == 'remove':
+                cursor.execute('DELETE FROM archives WHERE id = ?', (archive_id,))
+            else:
+                raise ValueError(f'Unknown catalog operation {operation}')
+            changed_entries.append((operation, archive_id, archive))
+        return changed_entries
+
+    def replace_all(self, archive_batches, pending_entries):
+        # Loads a snapshot, then replays local changes that have not been shipped yet on top of it.
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM archives')
+            for batch in archive_batches:
+                cursor.executemany(INSERT_ARCHIVE, [self.row_values(archive) for archive in batch])
+            self.apply_entries(cursor, pending_entries)
+
+    def iter_archives(self, batch_size=1000):
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute('SELECT rowid, * FROM archives WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                                               (last_rowid, batch_size)).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1]['rowid']
+            yield [{column: row[column] for column in ARCHIVE_COLUMNS} for row in rows]
+
+    def journal_entries(self, after_seq=0):
+        with self.lock:
+            rows = self.connection.execute('SELECT * FROM journal WHERE seq > ? ORDER BY seq', (after_seq,)).fetchall()
+        return [(row['seq'], row['operation'], row['archive_id'], json.loads(row['archive']) if row['archive'] else None)
+                for row in rows]
+
+    def prune_journal(self, up_to_seq):
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM journal WHERE seq <= ?', (up_to_seq,))
+
+    def get_sync_state(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        return json.loads(row['value']) if row else default
+
+    def set_sync_state(self, values):
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)',
+                               [(key, json.dumps(value)) for key, value in values.items()])
+
+    def get_retrieval(self, archive_id, byte_range=None):
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM retrieval_queue WHERE archive_id = ? AND byte_range = ?',
+                                          (archive_id, byte_range or '')).fetchone()
+        return dict(row, byte_range=row['byte_range'] or None) if row else None
+
+    def put_retrievals(self, requests):
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO retrieval_queue (archive_id, byte_range, tier, status, requested_at, '
+                               'not_before, attempts, error) VALUES (:archive_id, :byte_range, :tier, :status, '
+                               ':requested_at, :not_before, :attempts, :error)',
+                               [dict(request, byte_range=request['byte_range'] or '') for request in requests])
+
+    def remove_retrieval(self, archive_id, byte_range=None):
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM retrieval_queue WHERE archive_id = ? AND byte_range = ?',
+                           (archive_id, byte_range or ''))
+
+    def due_retrievals(self, now, limit=100):
+        with self.lock:
+            rows = self.connection.execute("SELECT * FROM retrieval_queue WHERE status = 'queued' AND not_before <= ? "
+                                           'ORDER BY requested_at LIMIT ?', (now, limit)).fetchall()
+        return [dict(row, byte_range=row['byte_range'] or None) for row in rows]
+
+    def pending_retrievals(self):
+        # Returns how many retrievals are still queued and when the earliest of them may be tried.
+        with self.lock:
+            row = self.connection.execute("SELECT COUNT(*), MIN(not_before) FROM retrieval_queue "
+                                          "WHERE status = 'queued'").fetchone()
+        return row[0], row[1]
+
+    def import_json(self, path):
+        if not os.path.exists(path) or os.stat(path).st_size == 0:
+            return []
+        with open(path, 'r') as archives:
+            try:
+                archives_list = json.load(archives)
+            except ValueError:
+                logger.warning("Couldn't import %s: invalid json format.", path)
+                return []
+        return self.add(archives_list)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
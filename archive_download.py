@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from tree_hash import MEGABYTE, TreeHashMismatch, combine_tree_hashes
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_SETTINGS = {
+    'chunk_size': 64 * MEGABYTE,
+    'max_workers': 4
+}
+
+
+class RangedDownloader:
+
+    def __init__(self, client, vault_name, account_id='-', chunk_size=None, max_workers=None):
+        self.client = client
+        self.vault_name = vault_name
+        self.account_id = account_id
+        self.chunk_size = chunk_size or DOWNLOAD_SETTINGS['chunk_size']
+        self.max_workers = max_workers or DOWNLOAD_SETTINGS['max_workers']
+        # Ranges have to stay tree-hash aligned for Glacier to return a checksum for each of them.
+        if self.chunk_size < MEGABYTE or self.chunk_size & (self.chunk_size - 1):
+            raise ValueError(f'Invalid chunk size {self.chunk_size}: must be 1 MiB multiplied by a power of two')
+        self.state_lock = threading.Lock()
+
+    def download(self, job_id, archive_size, filename, progress_callback=None):
+        partial_path = filename + '.part'
+        state_path = filename + '.part.json'
+        state = self.resume_state(state_path, partial_path, job_id, archive_size)
+        if state is None:
+            state = {'job_id': job_id, 'size': archive_size, 'chunk_size': self.chunk_size, 'verified': []}
+            with open(partial_path, 'wb') as partial_file:
+                partial_file.truncate(archive_size)
+            self.save_state(state_path, state)
+
+        chunk_count = math.ceil(archive_size / state['chunk_size'])
+        pending_chunks = [i for i in range(chunk_count) if i not in state['verified']]
+        self.progress_callback = progress_callback
+        self.verified_bytes = sum(min(state['chunk_size'], archive_size - i * state['chunk_size']) for i in state['verified'])
+        if progress_callback is not None:
+            progress_callback(self.verified_bytes, archive_size)
+        logger.info("Downloading %s of %s ranges of job %s.", len(pending_chunks), chunk_count, job_id)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.download_range, state, state_path, partial_path, i) for i in pending_chunks]
+            wait(futures, return_when=FIRST_EXCEPTION)
+            for future in futures:
+                future.cancel()
+        for future in futures:
+            if not future.cancelled() and future.exception():
+                logger.error("Download of job %s interrupted, it will resume from %s verified ranges.",
+                             job_id, len(state['verified']))
+                raise future.exception()
+
+        os.replace(partial_path, filename)
+        os.remove(state_path)
+
+    def download_range(self, state, state_path, partial_path, chunk_index):
+        start = chunk_index * state['chunk_size']
+        end = min(start + state['chunk_size'], state['size']) - 1
+        response = self.client.get_job_output(accountId=self.account_id,
+                                              vaultName=self.vault_name,
+                                              jobId=state['job_id'],
+                                              range=f'bytes={start}-{end}')
+        leaf_hashes = []
+        leaf = b''
+        with open(partial_path, 'r+b') as partial_file:
+            partial_file.seek(start)
+            for data in iter(lambda: response['body'].read(MEGABYTE), b''):
+                partial_file.write(data)
+                leaf += data
+                while len(leaf) >= MEGABYTE:
+                    leaf_hashes.append(hashlib.sha256(leaf[:MEGABYTE]).digest())
+                    leaf = leaf[MEGABYTE:]
+            if leaf or not leaf_hashes:
+                leaf_hashes.append(hashlib.sha256(leaf).digest())
+            written = partial_file.tell() - start
+        if written != end - start + 1:
+            raise IOError(f'Received {written} bytes for range {start}-{end} of job {state["job_id"]}')
+        checksum = combine_tree_hashes(leaf_hashes).hex()
+        if response.get('checksum') and response['checksum'] != checksum:
+            raise TreeHashMismatch(f'Tree hash of bytes {start}-{end} is {checksum}, expected {response["checksum"]}')
+        with self.state_lock:
+            state['verified'].append(chunk_index)
+            self.save_state(state_path, state)
+            self.verified_bytes += written
+            verified_bytes = self.verified_bytes
+        if self.progress_callback is not None:
+            self.progress_callback(verified_bytes, state['size'])
+
+    def resume_state(self, state_path, partial_path, job_id, archive_size):
+        if not os.path.exists(state_path) or not os.path.exists(partial_path):
+            return None
+        with open(state_path, 'r') as state_file:
+            try:
+                state = json.load(state_file)
+            except ValueError:
+                logger.warning("Ignoring unreadable download state %s.", state_path)
+                return None
+        if state['job_id'] != job_id or state['size'] != archive_size:
+            return None
+        logger.info("Resuming download of job %s with %s verified ranges.", job_id, len(state['verified']))
+        return state
+
+    def save_state(self, state_path, state):
+        temporary_path = state_path + '.tmp'
+        with open(temporary_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(temporary_path, state_path)
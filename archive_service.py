@@ -0,0 +1,363 @@
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from archive_download import RangedDownloader
+from aws_clients import CREDENTIALS, get_client, get_resource
+from catalog_sync import CatalogSync
+from inventory_import import InventoryFormatError, import_inventory, rebuild_tree_hash_index
+from job_cache import RetrievalJobCache, job_byte_range, job_output_size
+from multipart_upload import MultipartUploader
+from pack_archive import build_pack, extract_member, member_byte_range
+from retrieval_scheduler import RetrievalScheduler
+from tree_hash import TreeHash, TreeHashMismatch
+
+logger = logging.getLogger(__name__)
+
+BULK_DELETE_WORKERS = 8
+
+basedir = os.path.dirname(__file__)
+
+
+def no_progress(done, total):
+    pass
+
+
+class ArchiveService:
+    # Vault, catalog and job logic shared by the windows and the command line; nothing in here touches Qt.
+
+    def __init__(self, catalog, pack_dir=None, upload_state_dir=None):
+        self.catalog = catalog
+        self.pack_dir = pack_dir or os.path.join(basedir, 'storage/packs')
+        self.upload_state_dir = upload_state_dir
+        self.catalog_sync = None
+        self.job_cache_instance = None
+        self.retrieval_scheduler_instance = None
+        self.lock = threading.Lock()
+        self.tree_hash_index_lock = threading.Lock()
+
+    @property
+    def glacier_client(self):
+        return get_client('glacier')
+
+    @property
+    def job_cache(self):
+        with self.lock:
+            if self.job_cache_instance is None:
+                self.job_cache_instance = RetrievalJobCache(self.glacier_client, CREDENTIALS['vault_name'],
+                                                            CREDENTIALS['account_id'])
+            return self.job_cache_instance
+
+    @property
+    def retrieval_scheduler(self):
+        job_cache = self.job_cache
+        with self.lock:
+            if self.retrieval_scheduler_instance is None:
+                self.retrieval_scheduler_instance = RetrievalScheduler(self.glacier_client, CREDENTIALS['vault_name'],
+                                                                       CREDENTIALS['account_id'], self.catalog,
+                                                                       job_cache)
+            return self.retrieval_scheduler_instance
+
+    def upload_archive(self, file_to_archive, description='', progress_callback=None):
+        progress_callback = progress_callback or no_progress
+        file_size = os.stat(file_to_archive).st_size
+        # Hashing first reads the whole file once before any byte is sent, and the upload reads it again. That second
+        # local read is the price of skipping the transfer entirely when the content is already in the vault.
+        tree_hash = TreeHash.from_file(file_to_archive)
+        existing_archive = self.find_uploaded_archive(tree_hash, file_size)
+        if existing_archive is not None:
+            logger.info("Skipping upload of %s, its content is archive %s.", file_to_archive, existing_archive['id'])
+            progress_callback(file_size, file_size)
+            return []
+        archive_id = self.upload_file(file_to_archive, description, tree_hash, progress_callback)
+        file_extension = os.path.splitext(file_to_archive)[1]
+        return [{"id": archive_id, "description": description, "extension": file_extension, "size": f"{file_size/(1024 * 1024)} MB",
+                 "size_in_bytes": file_size, "creation_date": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                 "sha256_tree_hash": tree_hash.hexdigest()}]
+
+    def upload_pack(self, files_to_archive, description='', progress_callback=None, member_descriptions=None):
+        # Small files are concatenated into one archive; each keeps a catalog row pointing at its bytes in the pack.
+        # A member is described by the caller's relative path when given, so same-named files restore apart.
+        member_descriptions = dict(zip(files_to_archive, member_descriptions or []))
+        member_hashes = {}
+        for file_to_archive in files_to_archive:
+            tree_hash = TreeHash.from_file(file_to_archive)
+            if self.find_uploaded_archive(tree_hash, os.stat(file_to_archive).st_size) is None:
+                member_hashes[file_to_archive] = tree_hash.hexdigest()
+        if not member_hashes:
+            return []
+        os.makedirs(self.pack_dir, exist_ok=True)
+        pack_path = os.path.join(self.pack_dir, f'{uuid.uuid4().hex}.pack')
+        try:
+            members = build_pack(list(member_hashes), pack_path)
+            pack_size = os.stat(pack_path).st_size
+            pack_hash = TreeHash.from_file(pack_path)
+            pack_id = self.upload_file(pack_path, description, pack_hash, progress_callback)
+        finally:
+            if os.path.exists(pack_path):
+                os.remove(pack_path)
+        creation_date = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        archive_array = [{"id": pack_id, "description": description, "extension": '.pack', "size": f"{pack_size/(1024 * 1024)} MB",
+                          "size_in_bytes": pack_size, "creation_date": creation_date, "is_pack": 1,
+                          "sha256_tree_hash": pack_hash.hexdigest()}]
+        for i, member in enumerate(members):
+            member_name, member_extension = os.path.splitext(os.path.basename(member['path']))
+            member_description = member_descriptions.get(member['path'], member_name)
+            archive_array.append({"id": f'{pack_id}#{i}', "description": member_description, "extension": member_extension,
+                                  "size": f"{member['length']/(1024 * 1024)} MB", "size_in_bytes": member['length'],
+                                  "creation_date": creation_date, "pack_id": pack_id,
+                                  "pack_offset": member['offset'], "pack_length": member['length'],
+                                  "sha256_tree_hash": member_hashes[member['path']]})
+        return archive_array
+
+    def upload_file(self, file_to_archive, description='', tree_hash=None, progress_callback=None):
+        progress_callback = progress_callback or no_progress
+        file_size = os.stat(file_to_archive).st_size
+        tree_hash = tree_hash or TreeHash.from_file(file_to_archive)
+        if file_size/(1024 * 1024) >= 100:
+            uploader = MultipartUploader(self.glacier_client, CREDENTIALS['vault_name'], CREDENTIALS['account_id'],
+                                         state_dir=self.upload_state_dir)
+            return uploader.upload(file_to_archive, description, tree_hash=tree_hash, progress_callback=progress_callback)
+        with open(file_to_archive, 'rb') as upload_file:
+            progress_callback(0, file_size)
+            response = self.glacier_client.upload_archive(accountId=CREDENTIALS['account_id'],
+                                                          vaultName=CREDENTIALS['vault_name'],
+                                                          archiveDescription=description,
+                                                          checksum=tree_hash.hexdigest(),
+                                                          body=upload_file)
+            progress_callback(file_size, file_size)
+        return response['archiveId']
+
+    def find_uploaded_archive(self, tree_hash, file_size):
+        if not self.refresh_tree_hash_index():
+            return None
+        return self.catalog.find_by_tree_hash(tree_hash.hexdigest(), file_size)
+
+    def refresh_tree_hash_index(self):
+        # Archives listed by an inventory but uploaded elsewhere get their hashes from the last downloaded inventory.
+        path_to_inventory = os.path.join(basedir, 'storage/inventory.json')
+        with self.tree_hash_index_lock:
+            if not os.path.exists(path_to_inventory) or not self.catalog.missing_tree_hash_count():
+                return True
+            inventory_mtime = os.stat(path_to_inventory).st_mtime
+            if self.catalog.get_sync_state('tree_hash_index_inventory_mtime') == inventory_mtime:
+                return True
+            # A broken inventory only costs deduplication of the file being uploaded, it is not read again after that.
+            self.catalog.set_sync_state({'tree_hash_index_inventory_mtime': inventory_mtime})
+            try:
+                with open(path_to_inventory, 'rb') as inventory:
+                    rebuild_tree_hash_index(inventory, self.catalog)
+            except (InventoryFormatError, ValueError, OSError):
+                logger.warning("Couldn't index tree hashes from %s, uploading without deduplication.", path_to_inventory,
+                               exc_info=True)
+                return False
+            return True
+
+    def initiate_inventory_retrieval(self):
+        return self.glacier_client.initiate_job(accountId=CREDENTIALS['account_id'],
+                                                vaultName=CREDENTIALS['vault_name'],
+                                                jobParameters={'Type': 'inventory-retrieval'})
+
+    def find_most_recent_inventory_job(self):
+        most_recent_inventory_retrieval_job = None
+        paginator = self.glacier_client.get_paginator('list_jobs')
+        for page in paginator.paginate(accountId=CREDENTIALS['account_id'], vaultName=CREDENTIALS['vault_name'],
+                                       statuscode='Succeeded'):
+            for job in page['JobList']:
+                if job['Action'] == 'InventoryRetrieval' and (most_recent_inventory_retrieval_job is None or
+                                                              job['CreationDate'] > most_recent_inventory_retrieval_job['CreationDate']):
+                    most_recent_inventory_retrieval_job = job
+        return most_recent_inventory_retrieval_job
+
+    def download_inventory(self, job, progress_callback=None):
+        response = self.get_job_output(job)
+        return import_inventory(response['body'], self.catalog,
+                                copy_path=os.path.join(basedir, 'storage/inventory.json'),
+                                progress_callback=progress_callback,
+                                total_size=job.get('InventorySizeInBytes'))
+
+    def import_inventory_file(self, path, progress_callback=None):
+        with open(path, 'rb') as inventory:
+            return import_inventory(inventory, self.catalog, progress_callback=progress_callback,
+                                    total_size=os.stat(path).st_size)
+
+    def get_job_output(self, job):
+        try:
+            response = self.glacier_client.get_job_output(accountId=CREDENTIALS['account_id'],
+                                                          vaultName=CREDENTIALS['vault_name'],
+                                                          jobId=job['JobId'])
+            logger.info("Reading output of job %s.", job['JobId'])
+            if 'archiveDescription' in response:
+                logger.info(
+                    "These bytes are described as '%s'", response['archiveDescription'])
+        except ClientError:
+            logger.exception("Couldn't get output for job %s.", job['JobId'])
+            raise
+        else:
+            return response
+
+    def get_catalog_sync(self):
+        with self.lock:
+            if self.catalog_sync is None:
+                self.catalog_sync = CatalogSync(get_client('s3'), CREDENTIALS['bucket'], self.catalog)
+            return self.catalog_sync
+
+    def load_catalog_from_s3(self):
+        manifest = self.get_catalog_sync().pull()
+        if self.catalog.get_sync_state('legacy_catalog_imported'):
+            return
+        # Buckets written before the incremental sync only hold a full archives.json, which seeds the first push.
+        imported = manifest is None and self.import_legacy_catalog()
+        self.catalog.set_sync_state({'legacy_catalog_imported': True})
+        if imported:
+            self.sync_catalog_to_s3()
+
+    def import_legacy_catalog(self):
+        path_to_archives_json = os.path.join(basedir, 'storage/archives.json')
+        if not os.path.exists(path_to_archives_json):
+            bucket = get_resource('s3').Bucket(CREDENTIALS['bucket'])
+            try:
+                bucket.download_file('archives.json', path_to_archives_json)
+            except ClientError as error:
+                if error.response['Error']['Code'] not in ['NoSuchKey', '404']:
+                    raise
+                return []
+        return self.catalog.import_json(path_to_archives_json)
+
+    def sync_catalog_to_s3(self):
+        if not self.catalog.get_sync_state('legacy_catalog_imported'):
+            # A push before the first load would create the manifest, which then hides the legacy archives.json.
+            self.load_catalog_from_s3()
+        response = self.get_catalog_sync().push()
+        if response is None:
+            return
+        logger.info("Pushed catalog changes to bucket %s.", CREDENTIALS['bucket'],
+                    extra={'fields': {'event': 'catalog_pushed', 'bucket': CREDENTIALS['bucket'],
+                                      'etag': response.get('ETag'),
+                                      'request_id': response.get('ResponseMetadata', {}).get('RequestId')}})
+
+    def retrieval_target(self, archive_id):
+        # A pack member is retrieved as the byte range of its pack that holds it, rounded out to whole megabytes.
+        archive = self.catalog.get(archive_id)
+        if archive is None or not archive['pack_id']:
+            return archive_id, None, archive
+        if archive['pack_length'] == 0:
+            # An empty member has no bytes to retrieve, so it is restored without a vault round trip.
+            return None, None, archive
+        pack = self.catalog.get(archive['pack_id'])
+        if pack is None or pack['size_in_bytes'] is None:
+            return archive['pack_id'], None, archive
+        return archive['pack_id'], member_byte_range(archive['pack_offset'], archive['pack_length'],
+                                                     pack['size_in_bytes']), archive
+
+    def retrieval_status(self, archive_id):
+        glacier_id, byte_range, archive = self.retrieval_target(archive_id)
+        if glacier_id is None:
+            return True, True
+        retrieval_completed, retrieval_started = self.job_cache.status(glacier_id, byte_range)
+        return retrieval_completed, retrieval_started or self.retrieval_scheduler.is_queued(glacier_id, byte_range)
+
+    def request_retrievals(self, archive_ids, tier=None):
+        targets = [target for target in (self.retrieval_target(archive_id)[:2] for archive_id in archive_ids)
+                   if target[0] is not None]
+        return self.retrieval_scheduler.enqueue(targets, tier)
+
+    def output_filename(self, archive_id, path=None, directory=None):
+        archive = self.catalog.get(archive_id)
+        archive_file_extension, archive_description = (archive['extension'], archive['description']) if archive else (None, '')
+        if not path:
+            directory = directory or os.path.join(basedir, 'storage/output/')
+            path = os.path.join(directory, archive_description or archive_id)
+        if os.path.splitext(path)[1] == '':
+            return path + (archive_file_extension or '')
+        return path
+
+    def download_archive(self, archive_id, filename, progress_callback=None):
+        glacier_id, byte_range, archive = self.retrieval_target(archive_id)
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        if glacier_id is None:
+            open(filename, 'wb').close()
+            (progress_callback or no_progress)(0, 0)
+            return filename
+        retrieval_job = self.job_cache.get(glacier_id, byte_range=byte_range)
+        if retrieval_job is None or retrieval_job['StatusCode'] != 'Succeeded':
+            raise ValueError(f'Archive {archive_id} has no completed retrieval job')
+        downloader = RangedDownloader(self.glacier_client, CREDENTIALS['vault_name'], CREDENTIALS['account_id'])
+        if archive is None or not archive['pack_id']:
+            downloader.download(retrieval_job['JobId'], retrieval_job['ArchiveSizeInBytes'], filename, progress_callback)
+            return filename
+        byte_range = job_byte_range(retrieval_job)
+        range_start = int(byte_range.split('-')[0]) if byte_range else 0
+        range_path = filename + '.range'
+        downloader.download(retrieval_job['JobId'], job_output_size(retrieval_job), range_path, progress_callback)
+        extract_member(range_path, range_start, archive['pack_offset'], archive['pack_length'], filename)
+        os.remove(range_path)
+        # The range job only checks the whole megabytes it returned, the member itself is checked against its upload.
+        member_hash = TreeHash.from_file(filename).hexdigest()
+        if archive['sha256_tree_hash'] and member_hash != archive['sha256_tree_hash']:
+            os.remove(filename)
+            raise TreeHashMismatch(f'Tree hash of {archive_id} is {member_hash}, expected {archive["sha256_tree_hash"]}')
+        return filename
+
+    def plan_delete(self, archive_ids):
+        # A pack archive is deleted from the vault only once every one of its members is being deleted.
+        vault_ids = []
+        pack_members = {}
+        for archive_id in archive_ids:
+            archive = self.catalog.get(archive_id)
+            if archive is None or not archive['pack_id']:
+                vault_ids.append(archive_id)
+            else:
+                pack_members.setdefault(archive['pack_id'], []).append(archive_id)
+        kept_members = []
+        for pack_id, member_ids in pack_members.items():
+            if set(self.catalog.pack_members(pack_id)) <= set(member_ids):
+                vault_ids.append(pack_id)
+            else:
+                kept_members.extend(member_ids)
+        return vault_ids, pack_members, kept_members
+
+    def delete_archives_from_vault(self, archive_ids, progress_callback=None):
+        progress_callback = progress_callback or no_progress
+        client = self.glacier_client
+        responses = {}
+        failed = {}
+        with ThreadPoolExecutor(max_workers=BULK_DELETE_WORKERS) as executor:
+            futures = {executor.submit(client.delete_archive,
+                                       accountId=CREDENTIALS['account_id'],
+                                       vaultName=CREDENTIALS['vault_name'],
+                                       archiveId=archive_id): archive_id for archive_id in set(archive_ids)}
+            for i, future in enumerate(as_completed(futures)):
+                archive_id = futures[future]
+                progress_callback(i, len(futures))
+                try:
+                    responses[archive_id] = future.result()
+                except ClientError as error:
+                    # An archive that no longer exists in the vault only has to leave the catalog.
+                    if error.response['Error']['Code'] == 'ResourceNotFoundException':
+                        responses[archive_id] = error.response
+                    else:
+                        failed[archive_id] = str(error)
+        logger.info("Deleted %s archives, %s failed.", len(responses), len(failed),
+                    extra={'fields': {'event': 'archives_deleted', 'deleted': sorted(responses), 'failed': failed}})
+        return responses, failed
+
+    def remove_deleted_archives(self, responses, failed, pack_members, kept_members):
+        removed_ids = [archive_id for archive_id in responses if archive_id not in pack_members]
+        for pack_id, member_ids in pack_members.items():
+            if pack_id in responses:
+                removed_ids.extend([pack_id] + self.catalog.pack_members(pack_id))
+            elif pack_id in failed:
+                for member_id in member_ids:
+                    failed[member_id] = failed[pack_id]
+                del failed[pack_id]
+        # Members of packs that stay in the vault only leave the catalog.
+        removed_ids.extend(kept_members)
+        if removed_ids:
+            self.catalog.remove(removed_ids)
+        return removed_ids, failed
@@ -0,0 +1,75 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+from metrics import instrument_session
+
+CREDENTIALS = {
+    'access_key_id': 'access-key-id',
+    'secret_access_key': 'secret-access-key',
+    'vault_name': 'name',
+    'account_id': 'id',
+    'region': 'region',
+    'bucket': 'bucket-name'
+}
+
+# One pool is shared by every thread of the task scheduler and of the multipart/ranged transfers it runs.
+CLIENT_SETTINGS = {
+    'max_pool_connections': 64,
+    'connect_timeout': 10,
+    'read_timeout': 120,
+    'retries': {'max_attempts': 10, 'mode': 'adaptive'},
+    'tcp_keepalive': True
+}
+
+# Set to 'fake' to run against the in-process vault and bucket of fake_backend instead of AWS.
+BACKEND_ENVIRONMENT_VARIABLE = 'GLACIER_APP_BACKEND'
+
+lock = threading.Lock()
+session = None
+resources = {}
+backend = None
+
+
+def get_session():
+    global session
+    with lock:
+        if session is None:
+            session = boto3.session.Session(aws_access_key_id=CREDENTIALS['access_key_id'],
+                                            aws_secret_access_key=CREDENTIALS['secret_access_key'],
+                                            region_name=CREDENTIALS['region'])
+            instrument_session(session)
+        return session
+
+
+def set_backend(resource_factory):
+    # Routes every resource and client to resource_factory(service_name) instead of AWS; None switches back.
+    global backend
+    with lock:
+        backend = resource_factory
+        resources.clear()
+
+
+def get_backend():
+    global backend
+    with lock:
+        if backend is None and os.environ.get(BACKEND_ENVIRONMENT_VARIABLE) == 'fake':
+            from fake_backend import FakeBackend
+            backend = FakeBackend().resource
+        return backend
+
+
+def get_resource(service_name):
+    resource_factory = get_backend()
+    aws_session = get_session() if resource_factory is None else None
+    with lock:
+        if service_name not in resources:
+            resources[service_name] = resource_factory(service_name) if resource_factory is not None else \
+                aws_session.resource(service_name, config=Config(**CLIENT_SETTINGS))
+        return resources[service_name]
+
+
+def get_client(service_name):
+    return get_resource(service_name).meta.client
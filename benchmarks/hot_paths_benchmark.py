@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, basedir)
+
+import fake_backend
+from archive_catalog import ArchiveCatalog
+from archive_service import ArchiveService
+from cli import CLI_SETTINGS
+from metrics import registry
+from pack_archive import plan_packs
+
+BENCHMARK_SETTINGS = {
+    'large_file_mb': 256,
+    'small_file_count': 1000,
+    'small_file_kb': 64,
+    'catalog_sizes': [10000, 100000, 1000000],
+    # Archives added to and removed from a catalog of each size, like one upload or delete from the table.
+    'catalog_batch_size': 1000,
+    'inventory_size': 100000,
+    'table_size': 100000,
+    'restore_count': 20,
+    'restore_file_mb': 4
+}
+
+# Small enough to finish in seconds, for checking the suite itself rather than for comparing numbers.
+QUICK_SETTINGS = {
+    'large_file_mb': 120,
+    'small_file_count': 100,
+    'small_file_kb': 16,
+    'catalog_sizes': [10000],
+    'catalog_batch_size': 100,
+    'inventory_size': 10000,
+    'table_size': 10000,
+    'restore_count': 5,
+    'restore_file_mb': 2
+}
+
+MEGABYTE = 1024 * 1024
+
+
+def write_file(path, size, rng):
+    with open(path, 'wb') as written_file:
+        while size > 0:
+            written_file.write(rng.randbytes(min(size, 16 * MEGABYTE)))
+            size -= 16 * MEGABYTE
+
+
+def make_archives(count, rng, prefix='archive'):
+    archives = []
+    for i in range(count):
+        size = rng.randrange(1024, 1024 * MEGABYTE)
+        archives.append({'id': f'{prefix}-{i:09d}-{rng.randbytes(8).hex()}', 'description': f'file-{i:09d}',
+                         'extension': '.bin', 'size': f'{size/MEGABYTE} MB', 'size_in_bytes': size,
+                         'creation_date': f'2020-01-01T00:00:{i % 60:02d}Z',
+                         'sha256_tree_hash': rng.randbytes(32).hex()})
+    return archives
+
+
+def transfer_result(seconds, item_count, byte_count, failed_count=0):
+    return {'seconds': round(seconds, 3), 'items': item_count, 'failed': failed_count, 'bytes': byte_count,
+            'items_per_second': round(item_count / max(seconds, 0.001), 1),
+            'mb_per_second': round(byte_count / MEGABYTE / max(seconds, 0.001), 2)}
+
+
+def make_service(workdir, catalog_name):
+    # Packs and multipart upload state go to the work directory too, so nothing is left in the app's storage.
+    return ArchiveService(ArchiveCatalog(os.path.join(workdir, catalog_name)), pack_dir=os.path.join(workdir, 'packs'),
+                          upload_state_dir=os.path.join(workdir, 'uploads'))
+
+
+def upload_files(service, items, workers):
+    # Mirrors the command line upload: one task per file or pack, and one catalog commit per finished upload.
+    failed_count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(service.upload_pack if isinstance(item, list) else service.upload_archive, item)
+                   for item in items]
+        for future in as_completed(futures):
+            try:
+                service.catalog.add(future.result())
+            except Exception:
+                failed_count += 1
+    return failed_count
+
+
+def bench_upload_large(settings, workdir, rng):
+    path = os.path.join(workdir, 'large.bin')
+    write_file(path, settings['large_file_mb'] * MEGABYTE, rng)
+    service = make_service(workdir, 'archives.db')
+    started = time.perf_counter()
+    failed_count = upload_files(service, [path], 1)
+    result = transfer_result(time.perf_counter() - started, 1, os.stat(path).st_size, failed_count)
+    service.catalog.close()
+    return result
+
+
+def bench_upload_small(settings, workdir, rng):
+    paths = []
+    for i in range(settings['small_file_count']):
+        paths.append(os.path.join(workdir, f'small-{i:06d}.bin'))
+        write_file(paths[-1], settings['small_file_kb'] * 1024, rng)
+    total_size = sum(os.stat(path).st_size for path in paths)
+    results = {}
+    for mode in ['single', 'packed']:
+        service = make_service(workdir, f'archives-{mode}.db')
+        started = time.perf_counter()
+        if mode == 'packed':
+            packs, single_files = plan_packs(paths)
+            items = packs + single_files
+        else:
+            items = paths
+        failed_count = upload_files(service, items, CLI_SETTINGS['upload_workers'])
+        results[mode] = transfer_result(time.perf_counter() - started, len(paths), total_size, failed_count)
+        results[mode]['archives'] = len(items)
+        service.catalog.close()
+    return results
+
+
+def bench_catalog(settings, workdir, rng):
+    results = {}
+    batch_size = settings['catalog_batch_size']
+    for size in settings['catalog_sizes']:
+        catalog = ArchiveCatalog(os.path.join(workdir, f'archives-{size}.db'))
+        archives = make_archives(size, rng)
+        started = time.perf_counter()
+        catalog.add(archives)
+        fill_seconds = time.perf_counter() - started
+        batch = make_archives(batch_size, rng, prefix='batch')
+        started = time.perf_counter()
+        catalog.add(batch)
+        add_seconds = time.perf_counter() - started
+        removed_ids = [archive['id'] for archive in rng.sample(archives, min(batch_size, size))]
+        started = time.perf_counter()
+        catalog.remove(removed_ids)
+        remove_seconds = time.perf_counter() - started
+        middle_size = sorted(archive['size_in_bytes'] for archive in archives)[size // 2]
+        started = time.perf_counter()
+        catalog.page(500, 'size_in_bytes', True, after=(middle_size, 0))
+        page_seconds = time.perf_counter() - started
+        results[str(size)] = {'fill_seconds': round(fill_seconds, 3),
+                              'fill_rows_per_second': round(size / max(fill_seconds, 0.001)),
+                              'add_batch_ms': round(add_seconds * 1000, 1),
+                              'remove_batch_ms': round(remove_seconds * 1000, 1),
+                              'sorted_page_ms': round(page_seconds * 1000, 1)}
+        catalog.close()
+    return results
+
+
+def bench_inventory_import(settings, workdir, rng):
+    path = os.path.join(workdir, 'inventory.json')
+    archive_list = [{'ArchiveId': archive['id'], 'ArchiveDescription': archive['description'],
+                     'CreationDate': archive['creation_date'], 'Size': archive['size_in_bytes'],
+                     'SHA256TreeHash': archive['sha256_tree_hash']}
+                    for archive in make_archives(settings['inventory_size'], rng)]
+    with open(path, 'w') as inventory_file:
+        json.dump({'VaultARN': 'arn:aws:glacier:fake-region:id:vaults/name', 'InventoryDate': '2020-01-01T00:00:00Z',
+                   'ArchiveList': archive_list}, inventory_file)
+    service = make_service(workdir, 'archives.db')
+    results = {}
+    # The second import upserts over the rows of the first, which is what every later inventory does.
+    for run in ['first', 'repeat']:
+        started = time.perf_counter()
+        imported_count = service.import_inventory_file(path)
+        results[run] = transfer_result(time.perf_counter() - started, imported_count, os.stat(path).st_size)
+    service.catalog.close()
+    return results
+
+
+def bench_table_population(settings, workdir, rng):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt6 import QtWidgets
+    from PyQt6.QtCore import Qt
+    from ArchivesTableModel import ArchivesTableModel
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    catalog = ArchiveCatalog(os.path.join(workdir, 'archives.db'))
+    catalog.add(make_archives(settings['table_size'], rng))
+    timings = {}
+
+    def measure(name, action):
+        started = time.perf_counter()
+        action()
+        app.processEvents()
+        timings[f'{name}_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    view = QtWidgets.QTableView()
+    model = ArchivesTableModel(catalog)
+
+    def show_first_page():
+        view.setModel(model)
+        view.show()
+
+    def fetch_all():
+        while model.canFetchMore():
+            model.fetchMore()
+
+    measure('first_page', show_first_page)
+    measure('fetch_all', fetch_all)
+    measure('sort', lambda: model.sort(2, Qt.SortOrder.DescendingOrder))
+    measure('filter', lambda: model.set_filter('file-00000'))
+    view.close()
+    catalog.close()
+    return dict(rows=settings['table_size'], **timings)
+
+
+def bench_restore(settings, workdir, rng):
+    service = make_service(workdir, 'archives.db')
+    archive_ids = []
+    for i in range(settings['restore_count']):
+        path = os.path.join(workdir, f'restore-{i:04d}.bin')
+        write_file(path, settings['restore_file_mb'] * MEGABYTE, rng)
+        archive_ids.extend(archive['id'] for archive in service.catalog.add(service.upload_archive(path)))
+    total_size = settings['restore_count'] * settings['restore_file_mb'] * MEGABYTE
+    # Only the restore is measured, the uploads above just fill the fake vault.
+    registry.reset()
+    started = time.perf_counter()
+    service.request_retrievals(archive_ids, 'Bulk')
+    started_count, failed = service.retrieval_scheduler.run(wait_for_deferred=False)
+    request_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    service.job_cache.refresh(full=True)
+    ready_ids = [archive_id for archive_id in archive_ids if service.retrieval_status(archive_id)[0]]
+    failed_count = len(archive_ids) - len(ready_ids)
+    with ThreadPoolExecutor(max_workers=CLI_SETTINGS['download_workers']) as executor:
+        futures = [executor.submit(service.download_archive, archive_id,
+                                   service.output_filename(archive_id, directory=os.path.join(workdir, 'restored')))
+                   for archive_id in ready_ids]
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                failed_count += 1
+    result = transfer_result(time.perf_counter() - started, len(archive_ids), total_size, failed_count)
+    result.update(request_seconds=round(request_seconds, 3), jobs_started=started_count)
+    service.catalog.close()
+    return result
+
+
+BENCHMARK_CASES = {
+    'upload_large': bench_upload_large,
+    'upload_small': bench_upload_small,
+    'catalog': bench_catalog,
+    'inventory_import': bench_inventory_import,
+    'table_population': bench_table_population,
+    'restore': bench_restore
+}
+
+
+def run_benchmark(case_names, settings, backend_settings, seed):
+    results = {}
+    for case_name in case_names:
+        # Every case starts from an empty vault, bucket and catalog so cases can run alone or in any order.
+        fake_backend.install(backend_settings)
+        registry.reset()
+        with tempfile.TemporaryDirectory(prefix=f'glacier-benchmark-{case_name}-') as workdir:
+            results[case_name] = BENCHMARK_CASES[case_name](settings, workdir, random.Random(seed))
+        results[case_name]['api'] = registry.totals()
+        fake_backend.uninstall()
+    return results
+
+
+def print_results(prefix, result):
+    if all(isinstance(value, dict) for key, value in result.items() if key != 'api'):
+        for key, value in result.items():
+            if key != 'api':
+                print_results(f'{prefix} {key}', value)
+        return
+    print(f'{prefix:>24}: ' + '  '.join(f'{key} {value}' for key, value in result.items() if key != 'api'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure uploads, catalog writes, inventory import, table population '
+                                                 'and restores against the in-process fake vault.')
+    parser.add_argument('--cases', nargs='+', choices=list(BENCHMARK_CASES), default=list(BENCHMARK_CASES))
+    parser.add_argument('--quick', action='store_true', help='use small sizes to check that every case runs')
+    parser.add_argument('--catalog-sizes', type=int, nargs='+', help='catalog row counts to measure')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API call')
+    parser.add_argument('--bandwidth', type=float, help='MB/s of one connection, unlimited by default')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of API calls that fail')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='append the results as a JSON line to this file to track them over time')
+    args = parser.parse_args()
+    settings = dict(BENCHMARK_SETTINGS, **(QUICK_SETTINGS if args.quick else {}))
+    if args.catalog_sizes:
+        settings['catalog_sizes'] = args.catalog_sizes
+    backend_settings = {'latency': args.latency, 'bandwidth': args.bandwidth * MEGABYTE if args.bandwidth else None,
+                        'error_rate': args.error_rate, 'seed': args.seed}
+    results = run_benchmark(args.cases, settings, backend_settings, args.seed)
+    for case_name, result in results.items():
+        print_results(case_name, result)
+    if args.output:
+        with open(args.output, 'a') as output_file:
+            output_file.write(json.dumps({'time': time.time(), 'settings': settings, 'backend': backend_settings,
+                                          'results': results}) + '\n')
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+started = time.perf_counter()
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_startup():
+    # Runs inside a fresh interpreter so module imports and first paint are measured cold.
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    sys.path.insert(0, basedir)
+    from PyQt6 import QtWidgets
+    from PyQt6.QtCore import QTimer
+    import main
+    imported = time.perf_counter()
+    app = QtWidgets.QApplication(sys.argv)
+    win = main.MainWindow()
+    constructed = time.perf_counter()
+    win.show()
+    timings = {}
+
+    def on_first_event_loop_pass():
+        timings['first_window'] = time.perf_counter()
+        app.quit()
+
+    QTimer.singleShot(0, on_first_event_loop_pass)
+    app.exec()
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'construct_ms': (constructed - imported) * 1000,
+        'first_window_ms': (timings['first_window'] - started) * 1000
+    }))
+
+
+def run_benchmark(runs):
+    results = []
+    for _ in range(runs):
+        run_started = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result['process_ms'] = (time.perf_counter() - run_started) * 1000
+        results.append(result)
+    return {key: {'median': statistics.median(result[key] for result in results),
+                  'min': min(result[key] for result in results),
+                  'max': max(result[key] for result in results)}
+            for key in results[0]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure time from process start to the first shown main window.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='append the summary as a JSON line to this file to track it over time')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        measure_startup()
+    else:
+        summary = run_benchmark(args.runs)
+        for key, stats in summary.items():
+            print(f'{key:>16}: median {stats["median"]:8.1f} ms  min {stats["min"]:8.1f} ms  max {stats["max"]:8.1f} ms')
+        if args.output:
+            with open(args.output, 'a') as output_file:
+                output_file.write(json.dumps({'time': time.time(), 'runs': args.runs, 'summary': summary}) + '\n')
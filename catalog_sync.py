@@ -0,0 +1,164 @@
+import gzip
+import json
+import logging
+import socket
+import tempfile
+import uuid
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+SYNC_SETTINGS = {
+    'prefix': 'catalog/',
+    'compact_after_segments': 50,
+    'max_attempts': 5
+}
+
+# S3 answers a failed If-Match/If-None-Match write with 412, and a write racing another conditional write with 409.
+CONFLICT_CODES = ['PreconditionFailed', 'ConditionalRequestConflict', '412', '409']
+
+
+class CatalogSyncConflict(Exception):
+    pass
+
+
+def encode_entries(entries):
+    # Entries are compressed into a spooled file so a snapshot of a large catalog never sits in memory at once.
+    encoded_file = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    with gzip.GzipFile(fileobj=encoded_file, mode='wb') as compressed_file:
+        for operation, archive_id, archive in entries:
+            line = json.dumps({'operation': operation, 'archive_id': archive_id, 'archive': archive}) + '\n'
+            compressed_file.write(line.encode('utf-8'))
+    encoded_file.seek(0)
+    return encoded_file
+
+
+def decode_entries(body):
+    for line in gzip.decompress(body).decode('utf-8').splitlines():
+        if line:
+            entry = json.loads(line)
+            yield entry['operation'], entry['archive_id'], entry['archive']
+
+
+class CatalogSync:
+
+    def __init__(self, s3_client, bucket, catalog, prefix=None, compact_after_segments=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.catalog = catalog
+        self.prefix = prefix or SYNC_SETTINGS['prefix']
+        self.compact_after_segments = compact_after_segments or SYNC_SETTINGS['compact_after_segments']
+        self.manifest_key = self.prefix + 'manifest.json'
+        self.writer_id = self.catalog.get_sync_state('writer_id')
+        if self.writer_id is None:
+            self.writer_id = f'{socket.gethostname()}-{uuid.uuid4().hex[:8]}'
+            self.catalog.set_sync_state({'writer_id': self.writer_id})
+
+    def pull(self):
+        etag = self.catalog.get_sync_state('manifest_etag')
+        try:
+            arguments = {'IfNoneMatch': etag} if etag else {}
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.manifest_key, **arguments)
+        except ClientError as error:
+            if error.response['ResponseMetadata'].get('HTTPStatusCode') == 304:
+                return self.catalog.get_sync_state('manifest')
+            if error.response['Error']['Code'] in ['NoSuchKey', '404']:
+                self.catalog.set_sync_state({'manifest_etag': None, 'manifest': None})
+                return None
+            raise
+        manifest = json.loads(response['Body'].read())
+        applied_snapshot = self.catalog.get_sync_state('snapshot')
+        applied_segments = set(self.catalog.get_sync_state('applied_segments', []))
+        if manifest['snapshot'] and manifest['snapshot'] != applied_snapshot:
+            self.load_snapshot(manifest['snapshot'])
+            applied_segments = set()
+        new_segments = [segment for segment in manifest['segments'] if segment not in applied_segments]
+        for segment in new_segments:
+            body = self.s3_client.get_object(Bucket=self.bucket, Key=segment)['Body'].read()
+            self.catalog.apply(list(decode_entries(body)), journal=False)
+        logger.info("Pulled %s catalog segments from s3://%s/%s.", len(new_segments), self.bucket, self.prefix)
+        self.catalog.set_sync_state({'manifest_etag': response['ETag'],
+                                     'manifest': manifest,
+                                     'snapshot': manifest['snapshot'],
+                                     'applied_segments': sorted(applied_segments | set(new_segments))})
+        return manifest
+
+    def load_snapshot(self, snapshot_key):
+        body = self.s3_client.get_object(Bucket=self.bucket, Key=snapshot_key)['Body'].read()
+        pending_entries = [entry[1:] for entry in self.catalog.journal_entries(self.catalog.get_sync_state('pushed_seq', 0))]
+        archives = (archive for operation, archive_id, archive in decode_entries(body))
+        self.catalog.replace_all([archives], pending_entries)
+
+    def push(self):
+        pushed_seq = self.catalog.get_sync_state('pushed_seq', 0)
+        entries = self.catalog.journal_entries(pushed_seq)
+        if not entries:
+            return None
+        last_seq = entries[-1][0]
+        segment_key = f'{self.prefix}segments/{self.writer_id}-{last_seq:012d}.jsonl.gz'
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=segment_key,
+                                      Body=encode_entries(entry[1:] for entry in entries), IfNoneMatch='*')
+        except ClientError as error:
+            # The same key always holds the same changes, so it was written by an earlier, interrupted push.
+            if error.response['Error']['Code'] not in CONFLICT_CODES:
+                raise
+        for _ in range(SYNC_SETTINGS['max_attempts']):
+            manifest = self.pull() or {'snapshot': None, 'segments': []}
+            manifest = dict(manifest, segments=manifest['segments'] + [segment_key])
+            try:
+                response = self.put_manifest(manifest)
+            except CatalogSyncConflict:
+                logger.info("Catalog manifest changed while pushing, pulling and retrying.")
+                continue
+            applied_segments = self.catalog.get_sync_state('applied_segments', []) + [segment_key]
+            self.catalog.set_sync_state({'pushed_seq': last_seq,
+                                         'manifest_etag': response['ETag'],
+                                         'manifest': manifest,
+                                         'applied_segments': applied_segments})
+            self.catalog.prune_journal(last_seq)
+            logger.info("Pushed %s catalog changes as %s.", len(entries), segment_key)
+            if len(manifest['segments']) >= self.compact_after_segments:
+                self.compact()
+            return response
+        raise CatalogSyncConflict(f'Could not update s3://{self.bucket}/{self.manifest_key} after '
+                                  f'{SYNC_SETTINGS["max_attempts"]} attempts')
+
+    def compact(self):
+        manifest = self.pull() or {'snapshot': None, 'segments': []}
+        if self.catalog.journal_entries(self.catalog.get_sync_state('pushed_seq', 0)):
+            # Unpushed local changes would be missing from the snapshot, compact on the next push instead.
+            return
+        snapshot_key = f'{self.prefix}snapshots/{self.writer_id}-{uuid.uuid4().hex}.jsonl.gz'
+        entries = (('add', archive['id'], archive) for batch in self.catalog.iter_archives() for archive in batch)
+        self.s3_client.put_object(Bucket=self.bucket, Key=snapshot_key, Body=encode_entries(entries), IfNoneMatch='*')
+        compacted_manifest = {'snapshot': snapshot_key, 'segments': []}
+        try:
+            response = self.put_manifest(compacted_manifest)
+        except CatalogSyncConflict:
+            logger.info("Catalog manifest changed during compaction, leaving it for later.")
+            self.s3_client.delete_object(Bucket=self.bucket, Key=snapshot_key)
+            return
+        self.catalog.set_sync_state({'manifest_etag': response['ETag'],
+                                     'manifest': compacted_manifest,
+                                     'snapshot': snapshot_key,
+                                     'applied_segments': []})
+        obsolete_keys = manifest['segments'] + ([manifest['snapshot']] if manifest['snapshot'] else [])
+        for i in range(0, len(obsolete_keys), 1000):
+            self.s3_client.delete_objects(Bucket=self.bucket,
+                                          Delete={'Objects': [{'Key': key} for key in obsolete_keys[i:i + 1000]],
+                                                  'Quiet': True})
+        logger.info("Compacted %s catalog segments into %s.", len(manifest['segments']), snapshot_key)
+
+    def put_manifest(self, manifest):
+        etag = self.catalog.get_sync_state('manifest_etag')
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        try:
+            return self.s3_client.put_object(Bucket=self.bucket, Key=self.manifest_key,
+                                             Body=json.dumps(manifest).encode('utf-8'),
+                                             ContentType='application/json', **condition)
+        except ClientError as error:
+            if error.response['Error']['Code'] in CONFLICT_CODES:
+                raise CatalogSyncConflict(str(error))
+            raise
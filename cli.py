@@ -0,0 +1,235 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from archive_catalog import ArchiveCatalog
+from archive_service import ArchiveService
+from metrics import registry, setup_logging, stop_logging
+from pack_archive import plan_packs
+from retrieval_scheduler import RETRIEVAL_SETTINGS, RETRIEVAL_TIERS
+
+logger = logging.getLogger(__name__)
+
+CLI_SETTINGS = {
+    'upload_workers': 4,
+    'download_workers': 2
+}
+
+basedir = os.path.dirname(__file__)
+
+
+class TransferReport:
+    # Collects byte counts from concurrent transfers and prints one line per finished item and a summary.
+
+    def __init__(self, total_count, action):
+        self.total_count = total_count
+        self.action = action
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.done_count = 0
+        self.skipped_count = 0
+        self.failed = {}
+        self.transferred_bytes = {}
+
+    def progress_callback(self, item):
+        def report(done, total):
+            with self.lock:
+                self.transferred_bytes[item] = done
+        return report
+
+    def item_done(self, item, size, skipped=False, label=None):
+        with self.lock:
+            self.done_count += 1
+            if skipped:
+                self.skipped_count += 1
+                self.transferred_bytes.pop(item, None)
+            else:
+                self.transferred_bytes[item] = size
+            state = 'skipped, already in the vault' if skipped else self.action
+            print(f'[{self.done_count + len(self.failed)}/{self.total_count}] {state}: {label or item} '
+                  f'({size/(1024 * 1024):.1f} MB)', flush=True)
+
+    def item_failed(self, item, error, label=None):
+        with self.lock:
+            self.failed[item] = str(error)
+            print(f'[{self.done_count + len(self.failed)}/{self.total_count}] failed: {label or item}: {error}',
+                  file=sys.stderr, flush=True)
+
+    def print_summary(self):
+        elapsed = time.monotonic() - self.started
+        total_bytes = sum(self.transferred_bytes.values())
+        print(f'{self.done_count - self.skipped_count} {self.action}, {self.skipped_count} skipped, '
+              f'{len(self.failed)} failed of {self.total_count} in {elapsed:.1f} s: '
+              f'{total_bytes/(1024 * 1024):.1f} MB at {total_bytes/(1024 * 1024)/max(elapsed, 0.001):.2f} MB/s')
+
+
+def upload_dir(service, arguments):
+    file_paths = []
+    for directory, directory_names, file_names in os.walk(arguments.directory):
+        directory_names.sort()
+        file_paths.extend(os.path.join(directory, file_name) for file_name in sorted(file_names))
+    if arguments.pack:
+        packs, single_files = plan_packs(file_paths)
+    else:
+        packs, single_files = [], file_paths
+    # Items are keyed by position, since packs of the same size from one directory would share a name.
+    items = [(f'pack {i + 1}: {len(pack)} files from {os.path.dirname(pack[0])}', pack) for i, pack in enumerate(packs)]
+    items.extend((file_path, file_path) for file_path in single_files)
+    report = TransferReport(len(items), 'uploaded')
+
+    def upload(index, item):
+        if isinstance(item, list):
+            description = arguments.description or os.path.basename(os.path.abspath(arguments.directory))
+            member_descriptions = [os.path.relpath(path, arguments.directory) for path in item]
+            return service.upload_pack(item, description, report.progress_callback(index), member_descriptions)
+        description = arguments.description or os.path.relpath(item, arguments.directory)
+        return service.upload_archive(item, description, report.progress_callback(index))
+
+    with ThreadPoolExecutor(max_workers=arguments.workers) as executor:
+        futures = {executor.submit(upload, index, item): index for index, (name, item) in enumerate(items)}
+        for future in as_completed(futures):
+            index = futures[future]
+            name, item = items[index]
+            size = sum(os.stat(path).st_size for path in item) if isinstance(item, list) else os.stat(item).st_size
+            try:
+                archive_array = future.result()
+            except Exception as error:
+                report.item_failed(index, error, label=name)
+                continue
+            service.catalog.add(archive_array)
+            report.item_done(index, size, skipped=not archive_array, label=name)
+    report.print_summary()
+    return report
+
+
+def restore(service, arguments):
+    archive_ids = list(arguments.archive_ids)
+    if arguments.ids_file:
+        with open(arguments.ids_file) as ids_file:
+            archive_ids.extend(line.strip() for line in ids_file if line.strip())
+    archive_ids = list(dict.fromkeys(archive_ids))
+    report = TransferReport(len(archive_ids), 'restored')
+    remaining_ids = archive_ids
+    while True:
+        service.job_cache.refresh(full=True)
+        ready_ids = []
+        not_requested_ids = []
+        for archive_id in remaining_ids:
+            retrieval_completed, retrieval_started = service.retrieval_status(archive_id)
+            if retrieval_completed:
+                ready_ids.append(archive_id)
+            elif not retrieval_started:
+                not_requested_ids.append(archive_id)
+        queued_count = 0
+        if not_requested_ids:
+            queued_count, coalesced_count = service.request_retrievals(not_requested_ids, arguments.tier)
+        # Requests deferred by throttling or expedited capacity stay queued, so every pass starts the ones now due.
+        if queued_count or service.retrieval_scheduler.pending_count():
+            started_count, failed = service.retrieval_scheduler.run(wait_for_deferred=False)
+            print(f'Requested {queued_count} retrievals ({arguments.tier}), started {started_count} jobs', flush=True)
+            for archive_id in remaining_ids:
+                glacier_id = service.retrieval_target(archive_id)[0]
+                if glacier_id in failed:
+                    report.item_failed(archive_id, failed[glacier_id])
+        download_ready(service, ready_ids, arguments, report)
+        remaining_ids = [archive_id for archive_id in remaining_ids
+                         if archive_id not in ready_ids and archive_id not in report.failed]
+        if not remaining_ids or not arguments.wait:
+            break
+        print(f'Waiting for {len(remaining_ids)} retrievals to complete', flush=True)
+        time.sleep(service.job_cache.refresh_interval)
+    if remaining_ids:
+        print(f'{len(remaining_ids)} retrievals are still in progress, run the restore again later')
+    report.print_summary()
+    return report
+
+
+def download_ready(service, archive_ids, arguments, report):
+    with ThreadPoolExecutor(max_workers=arguments.workers) as executor:
+        futures = {executor.submit(service.download_archive, archive_id,
+                                   service.output_filename(archive_id, directory=arguments.target),
+                                   report.progress_callback(archive_id)): archive_id for archive_id in archive_ids}
+        for future in as_completed(futures):
+            archive_id = futures[future]
+            try:
+                filename = future.result()
+            except Exception as error:
+                report.item_failed(archive_id, error)
+                continue
+            report.item_done(archive_id, os.stat(filename).st_size, label=f'{archive_id} -> {filename}')
+
+
+def import_inventory(service, arguments):
+    started = time.monotonic()
+    if arguments.inventory_file:
+        source = arguments.inventory_file
+        imported_count = service.import_inventory_file(arguments.inventory_file)
+    else:
+        job = service.find_most_recent_inventory_job()
+        if job is None:
+            print('There are no completed inventory jobs to import, start one and try again later', file=sys.stderr)
+            return None
+        source = f'job {job["JobId"]}'
+        imported_count = service.download_inventory(job)
+    elapsed = time.monotonic() - started
+    print(f'Imported {imported_count} archives from {source} in {elapsed:.1f} s '
+          f'({imported_count/max(elapsed, 0.001):.0f} archives/s)')
+    return imported_count
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Upload, restore and catalog AWS Glacier archives without the GUI.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request and job')
+    parser.add_argument('--offline', action='store_true', help="don't pull or push the catalog from S3")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    upload_parser = subparsers.add_parser('upload-dir', help='upload every file below a directory')
+    upload_parser.add_argument('directory')
+    upload_parser.add_argument('--description', default='', help='archive description, defaults to the relative path')
+    upload_parser.add_argument('--pack', action='store_true', help='pack small files into shared archives')
+    upload_parser.add_argument('--workers', type=int, default=CLI_SETTINGS['upload_workers'])
+    upload_parser.set_defaults(run=upload_dir)
+
+    restore_parser = subparsers.add_parser('restore', help='retrieve archives and download the ready ones')
+    restore_parser.add_argument('archive_ids', nargs='*')
+    restore_parser.add_argument('--ids-file', help='file with one archive id per line')
+    restore_parser.add_argument('--target', required=True, help='directory the archives are written to')
+    restore_parser.add_argument('--tier', choices=RETRIEVAL_TIERS, default=RETRIEVAL_SETTINGS['default_tier'])
+    restore_parser.add_argument('--wait', action='store_true', help='keep polling until every archive is restored')
+    restore_parser.add_argument('--workers', type=int, default=CLI_SETTINGS['download_workers'])
+    restore_parser.set_defaults(run=restore)
+
+    inventory_parser = subparsers.add_parser('import-inventory',
+                                             help='import an inventory file, or the most recent inventory job')
+    inventory_parser.add_argument('inventory_file', nargs='?')
+    inventory_parser.set_defaults(run=import_inventory)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    setup_logging(console_level=logging.INFO if arguments.verbose else logging.WARNING)
+    catalog = ArchiveCatalog(os.path.join(basedir, 'storage/archives.db'))
+    service = ArchiveService(catalog)
+    try:
+        if not arguments.offline:
+            service.load_catalog_from_s3()
+        result = arguments.run(service, arguments)
+        if not arguments.offline:
+            service.sync_catalog_to_s3()
+    finally:
+        catalog.close()
+        for line in registry.report_lines():
+            print(line)
+        stop_logging()
+    if result is None or getattr(result, 'failed', None):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,491 @@
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import secrets
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import botocore.session
+from botocore import xform_name
+from botocore.exceptions import ClientError, ParamValidationError
+from botocore.response import StreamingBody
+from botocore.validate import ParamValidator
+
+import aws_clients
+from metrics import body_size, registry
+from tree_hash import MEGABYTE, TreeHash
+
+FAKE_BACKEND_SETTINGS = {
+    # Seconds added to every call, standing in for the round trip to the region.
+    'latency': 0.0,
+    # Bytes per second of one connection, applied to request and response bodies; None transfers instantly.
+    'bandwidth': None,
+    # Share of calls that fail before reaching the vault or bucket, with a code picked from error_codes.
+    'error_rate': 0.0,
+    'error_codes': ['RequestTimeoutException', 'ThrottlingException', 'ServiceUnavailableException'],
+    # Operation names that may fail, for example ['InitiateJob']; None lets every operation fail.
+    'error_operations': None,
+    # Seconds until a job completes; real vaults take minutes for Expedited and up to 12 hours for Bulk.
+    'job_delays': {'Expedited': 0, 'Standard': 0, 'Bulk': 0, 'Inventory': 0},
+    'provisioned_capacity_units': 0,
+    'list_jobs_page_size': 50,
+    'list_parts_page_size': 1000,
+    'seed': None,
+    # Checks every call against the botocore service model, so a misspelled parameter fails here as it would on AWS.
+    'validate_parameters': True
+}
+
+# JSON object merged over FAKE_BACKEND_SETTINGS, e.g. '{"latency": 0.05, "bandwidth": 10485760}'.
+SETTINGS_ENVIRONMENT_VARIABLE = 'GLACIER_APP_FAKE_SETTINGS'
+
+ERROR_STATUS = {
+    'ResourceNotFoundException': 404,
+    'RequestTimeoutException': 408,
+    'ServiceUnavailableException': 500,
+    'NoSuchKey': 404,
+    'NoSuchUpload': 404,
+    'PreconditionFailed': 412,
+    '304': 304
+}
+
+MULTIPART_RANGE = re.compile(r'bytes (\d+)-(\d+)/\*')
+OUTPUT_RANGE = re.compile(r'bytes=(\d+)-(\d*)')
+
+
+class FakeServiceError(Exception):
+
+    def __init__(self, code, message=''):
+        super(FakeServiceError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+def environment_settings():
+    value = os.environ.get(SETTINGS_ENVIRONMENT_VARIABLE)
+    return json.loads(value) if value else {}
+
+
+def timestamp():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def read_body(body):
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    if hasattr(body, 'read'):
+        return body.read()
+    return bytes(body)
+
+
+def range_tree_hash(data, start, total_size):
+    # Glacier only returns a checksum for ranges that line up with the 1 MiB leaves of the tree hash.
+    end = start + len(data)
+    if start % MEGABYTE or (end % MEGABYTE and end != total_size):
+        return None
+    return TreeHash.from_buffer(data).hexdigest()
+
+
+class FakeVault:
+
+    def __init__(self, name, account_id):
+        self.name = name
+        self.arn = f'arn:aws:glacier:fake-region:{account_id}:vaults/{name}'
+        self.archives = {}
+        self.uploads = {}
+        self.jobs = {}
+
+
+class FakeGlacier:
+    # Keeps archives, multipart uploads and jobs in memory; methods are named and called like the client's operations.
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.vaults = {}
+
+    def vault(self, vault_name, account_id='-'):
+        with self.backend.lock:
+            if vault_name not in self.vaults:
+                self.vaults[vault_name] = FakeVault(vault_name, account_id)
+            return self.vaults[vault_name]
+
+    def add_archive(self, vault, data, description, tree_hash=None):
+        archive_id = secrets.token_urlsafe(104)[:138]
+        tree_hash = tree_hash or TreeHash.from_buffer(data).hexdigest()
+        with self.backend.lock:
+            vault.archives[archive_id] = {'data': data, 'description': description or '', 'creation_date': timestamp(),
+                                          'tree_hash': tree_hash}
+        return {'ResponseMetadata': {'HTTPStatusCode': 201}, 'archiveId': archive_id, 'checksum': tree_hash,
+                'location': f'/{vault.name}/archives/{archive_id}'}
+
+    def upload_archive(self, vaultName, accountId, archiveDescription=None, checksum=None, body=None):
+        data = read_body(body)
+        tree_hash = TreeHash.from_buffer(data).hexdigest()
+        if checksum and tree_hash != checksum:
+            raise FakeServiceError('InvalidParameterValueException', 'Checksum mismatch')
+        return self.add_archive(self.vault(vaultName, accountId), data, archiveDescription, tree_hash)
+
+    def initiate_multipart_upload(self, vaultName, accountId, archiveDescription=None, partSize=None):
+        part_size = int(partSize)
+        if part_size < MEGABYTE or part_size > 4096 * MEGABYTE or part_size & (part_size - 1):
+            raise FakeServiceError('InvalidParameterValueException', f'Invalid part size: {partSize}')
+        upload_id = uuid.uuid4().hex
+        self.vault(vaultName, accountId).uploads[upload_id] = {'description': archiveDescription, 'part_size': part_size,
+                                                               'creation_date': timestamp(), 'parts': {}}
+        return {'ResponseMetadata': {'HTTPStatusCode': 201}, 'uploadId': upload_id,
+                'location': f'/{vaultName}/multipart-uploads/{upload_id}'}
+
+    def get_upload(self, vault_name, account_id, upload_id):
+        upload = self.vault(vault_name, account_id).uploads.get(upload_id)
+        if upload is None:
+            raise FakeServiceError('ResourceNotFoundException', f'Unknown upload ID: {upload_id}')
+        return upload
+
+    def upload_multipart_part(self, vaultName, accountId, uploadId, checksum=None, range=None, body=None):
+        upload = self.get_upload(vaultName, accountId, uploadId)
+        data = read_body(body)
+        match = MULTIPART_RANGE.fullmatch(range or '')
+        if match is None:
+            raise FakeServiceError('InvalidParameterValueException', f'Invalid content range: {range}')
+        start, end = int(match.group(1)), int(match.group(2))
+        if start % upload['part_size'] or end - start + 1 != len(data) or len(data) > upload['part_size']:
+            raise FakeServiceError('InvalidParameterValueException', f'Content range {range} does not match the part')
+        part_checksum = TreeHash.from_buffer(data).hexdigest()
+        if checksum and checksum != part_checksum:
+            raise FakeServiceError('InvalidParameterValueException', 'Checksum mismatch')
+        upload['parts'][start] = (data, part_checksum)
+        return {'ResponseMetadata': {'HTTPStatusCode': 204}, 'checksum': part_checksum}
+
+    def complete_multipart_upload(self, vaultName, accountId, uploadId, archiveSize=None, checksum=None):
+        vault = self.vault(vaultName, accountId)
+        with self.backend.lock:
+            upload = self.get_upload(vaultName, accountId, uploadId)
+            starts = sorted(upload['parts'])
+            if sum(len(upload['parts'][start][0]) for start in starts) != int(archiveSize) or \
+                    any(start != i * upload['part_size'] for i, start in enumerate(starts)):
+                raise FakeServiceError('InvalidParameterValueException', 'Parts do not add up to the archive size')
+            del vault.uploads[uploadId]
+        data = b''.join(upload['parts'][start][0] for start in starts)
+        tree_hash = TreeHash.from_buffer(data).hexdigest()
+        if checksum and tree_hash != checksum:
+            raise FakeServiceError('InvalidParameterValueException', 'Checksum mismatch')
+        return self.add_archive(vault, data, upload['description'], tree_hash)
+
+    def abort_multipart_upload(self, vaultName, accountId, uploadId):
+        with self.backend.lock:
+            self.get_upload(vaultName, accountId, uploadId)
+            del self.vault(vaultName, accountId).uploads[uploadId]
+        return {'ResponseMetadata': {'HTTPStatusCode': 204}}
+
+    def list_parts(self, vaultName, accountId, uploadId, marker=None, limit=None):
+        upload = self.get_upload(vaultName, accountId, uploadId)
+        with self.backend.lock:
+            parts = [{'RangeInBytes': f'{start}-{start + len(data) - 1}', 'SHA256TreeHash': part_checksum}
+                     for start, (data, part_checksum) in sorted(upload['parts'].items())]
+        page, next_marker = self.page(parts, marker, limit or self.backend.settings['list_parts_page_size'])
+        return {'MultipartUploadId': uploadId, 'VaultARN': self.vault(vaultName, accountId).arn,
+                'ArchiveDescription': upload['description'], 'PartSizeInBytes': upload['part_size'],
+                'CreationDate': upload['creation_date'], 'Parts': page, 'Marker': next_marker}
+
+    def initiate_job(self, vaultName, accountId, jobParameters=None):
+        vault = self.vault(vaultName, accountId)
+        parameters = jobParameters or {}
+        job = {'JobId': secrets.token_urlsafe(69)[:92], 'JobDescription': parameters.get('Description'),
+               'VaultARN': vault.arn, 'CreationDate': timestamp(), 'Completed': False, 'StatusCode': 'InProgress'}
+        if parameters.get('Type') == 'archive-retrieval':
+            archive = vault.archives.get(parameters.get('ArchiveId'))
+            if archive is None:
+                raise FakeServiceError('ResourceNotFoundException', f'Archive not found: {parameters.get("ArchiveId")}')
+            size = len(archive['data'])
+            start, end = self.retrieval_byte_range(parameters.get('RetrievalByteRange'), size)
+            output = archive['data'][start:end + 1]
+            tier = parameters.get('Tier') or 'Standard'
+            job.update({'Action': 'ArchiveRetrieval', 'ArchiveId': parameters['ArchiveId'], 'ArchiveSizeInBytes': size,
+                        'ArchiveSHA256TreeHash': archive['tree_hash'], 'RetrievalByteRange': f'{start}-{end}',
+                        'SHA256TreeHash': range_tree_hash(output, start, size), 'Tier': tier})
+        elif parameters.get('Type') == 'inventory-retrieval':
+            # The listing is taken when the job starts, which is as stale as the inventories Glacier hands out.
+            tier = 'Inventory'
+            with self.backend.lock:
+                archive_list = [{'ArchiveId': archive_id, 'ArchiveDescription': archive['description'],
+                                 'CreationDate': archive['creation_date'], 'Size': len(archive['data']),
+                                 'SHA256TreeHash': archive['tree_hash']} for archive_id, archive in vault.archives.items()]
+            output = json.dumps({'VaultARN': vault.arn, 'InventoryDate': timestamp(),
+                                 'ArchiveList': archive_list}).encode()
+            job['Action'] = 'InventoryRetrieval'
+        else:
+            raise FakeServiceError('InvalidParameterValueException', f'Unsupported job type: {parameters.get("Type")}')
+        vault.jobs[job['JobId']] = {'job': job, 'output': output,
+                                    'ready_at': time.monotonic() + self.backend.settings['job_delays'].get(tier, 0)}
+        return {'ResponseMetadata': {'HTTPStatusCode': 202}, 'jobId': job['JobId'],
+                'location': f'/{vaultName}/jobs/{job["JobId"]}'}
+
+    @staticmethod
+    def retrieval_byte_range(byte_range, size):
+        if not byte_range:
+            return 0, size - 1
+        start, end = (int(value) for value in byte_range.split('-'))
+        if start % MEGABYTE or end < start or end >= size or ((end + 1) % MEGABYTE and end != size - 1):
+            raise FakeServiceError('InvalidParameterValueException', f'Invalid retrieval byte range: {byte_range}')
+        return start, end
+
+    def job_view(self, stored_job):
+        job = dict(stored_job['job'])
+        if time.monotonic() >= stored_job['ready_at']:
+            job.update({'Completed': True, 'StatusCode': 'Succeeded', 'StatusMessage': 'Succeeded',
+                        'CompletionDate': timestamp()})
+            if job['Action'] == 'InventoryRetrieval':
+                job['InventorySizeInBytes'] = len(stored_job['output'])
+        return job
+
+    def get_job(self, vault_name, account_id, job_id):
+        stored_job = self.vault(vault_name, account_id).jobs.get(job_id)
+        if stored_job is None:
+            raise FakeServiceError('ResourceNotFoundException', f'Job not found: {job_id}')
+        return stored_job
+
+    def describe_job(self, vaultName, accountId, jobId):
+        return self.job_view(self.get_job(vaultName, accountId, jobId))
+
+    def list_jobs(self, vaultName, accountId, limit=None, marker=None, statuscode=None, completed=None):
+        vault = self.vault(vaultName, accountId)
+        with self.backend.lock:
+            jobs = [self.job_view(stored_job) for stored_job in vault.jobs.values()]
+        jobs = [job for job in jobs if (statuscode is None or job['StatusCode'] == statuscode) and
+                (completed is None or str(job['Completed']).lower() == completed)]
+        page, next_marker = self.page(jobs, marker, int(limit or self.backend.settings['list_jobs_page_size']))
+        return {'JobList': page, 'Marker': next_marker}
+
+    def get_job_output(self, vaultName, accountId, jobId, range=None):
+        stored_job = self.get_job(vaultName, accountId, jobId)
+        job = self.job_view(stored_job)
+        if not job['Completed']:
+            raise FakeServiceError('InvalidParameterValueException', f'The job is not currently available: {jobId}')
+        output = stored_job['output']
+        start, end = 0, len(output) - 1
+        if range:
+            match = OUTPUT_RANGE.fullmatch(range)
+            if match is None:
+                raise FakeServiceError('InvalidParameterValueException', f'Invalid range: {range}')
+            start, end = int(match.group(1)), min(int(match.group(2) or end), end)
+        data = output[start:end + 1]
+        response = {'ResponseMetadata': {'HTTPStatusCode': 206 if range else 200}, 'body': data,
+                    'status': 206 if range else 200, 'acceptRanges': 'bytes',
+                    'contentType': 'application/json' if job['Action'] == 'InventoryRetrieval' else
+                    'application/octet-stream'}
+        if range:
+            response['contentRange'] = f'bytes {start}-{end}/{len(output)}'
+        checksum = range_tree_hash(data, start, len(output)) if job['Action'] == 'ArchiveRetrieval' else None
+        if checksum:
+            response['checksum'] = checksum
+        return response
+
+    def delete_archive(self, vaultName, accountId, archiveId):
+        if self.vault(vaultName, accountId).archives.pop(archiveId, None) is None:
+            raise FakeServiceError('ResourceNotFoundException', f'Archive not found: {archiveId}')
+        return {'ResponseMetadata': {'HTTPStatusCode': 204}}
+
+    def list_provisioned_capacity(self, accountId):
+        return {'ProvisionedCapacityList': [{'CapacityId': f'fake-capacity-{i}', 'StartDate': timestamp()}
+                                            for i in range(self.backend.settings['provisioned_capacity_units'])]}
+
+    @staticmethod
+    def page(items, marker, limit):
+        start = int(marker or 0)
+        next_marker = str(start + limit) if start + limit < len(items) else None
+        return items[start:start + limit], next_marker
+
+
+class FakeS3:
+    # Objects with ETags and the conditional reads and writes the catalog sync relies on.
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.buckets = {}
+
+    def objects(self, bucket):
+        return self.buckets.setdefault(bucket, {})
+
+    def get_object(self, Bucket, Key, IfMatch=None, IfNoneMatch=None, **kwargs):
+        stored_object = self.objects(Bucket).get(Key)
+        if stored_object is None:
+            raise FakeServiceError('NoSuchKey', 'The specified key does not exist.')
+        if IfMatch is not None and IfMatch != stored_object['etag']:
+            raise FakeServiceError('PreconditionFailed', 'At least one of the pre-conditions you specified did not hold')
+        if IfNoneMatch is not None and IfNoneMatch in ('*', stored_object['etag']):
+            raise FakeServiceError('304', 'Not Modified')
+        return {'Body': stored_object['data'], 'ETag': stored_object['etag'], 'ContentLength': len(stored_object['data']),
+                'LastModified': stored_object['last_modified']}
+
+    def put_object(self, Bucket, Key, Body=None, IfMatch=None, IfNoneMatch=None, **kwargs):
+        objects = self.objects(Bucket)
+        if IfNoneMatch == '*' and Key in objects:
+            raise FakeServiceError('PreconditionFailed', 'At least one of the pre-conditions you specified did not hold')
+        if IfMatch is not None and Key not in objects:
+            raise FakeServiceError('NoSuchKey', 'The specified key does not exist.')
+        if IfMatch is not None and IfMatch != objects[Key]['etag']:
+            raise FakeServiceError('PreconditionFailed', 'At least one of the pre-conditions you specified did not hold')
+        data = read_body(Body)
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        objects[Key] = {'data': data, 'etag': etag, 'last_modified': datetime.now(timezone.utc)}
+        return {'ETag': etag}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects(Bucket).pop(Key, None)
+        return {'ResponseMetadata': {'HTTPStatusCode': 204}}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        for deleted_object in Delete['Objects']:
+            self.objects(Bucket).pop(deleted_object['Key'], None)
+        return {'Deleted': [{'Key': deleted_object['Key']} for deleted_object in Delete['Objects']]}
+
+
+class FakeClient:
+    # Stands in for a botocore client: same method names and parameters, with the backend's latency and errors.
+
+    def __init__(self, backend, service_name, store):
+        self.backend = backend
+        self.store = store
+        self.service_model = botocore.session.get_session().get_service_model(service_name)
+        self.operation_names = {xform_name(name): name for name in self.service_model.operation_names}
+        self.validator = ParamValidator()
+
+    def __getattr__(self, name):
+        if name not in self.operation_names or not hasattr(self.store, name):
+            raise AttributeError(f"Fake {self.service_model.service_name} client has no operation {name}")
+        return lambda **params: self.call(self.operation_names[name], getattr(self.store, name), params)
+
+    def can_paginate(self, operation_name):
+        return operation_name in ('list_jobs', 'list_parts')
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(getattr(self, operation_name))
+
+    def call(self, operation_name, handler, params):
+        operation_model = self.service_model.operation_model(operation_name)
+        if self.backend.settings['validate_parameters']:
+            report = self.validator.validate(params, operation_model.input_shape)
+            if report.has_errors():
+                raise ParamValidationError(report=report.generate_report())
+        metrics_operation = f'{self.service_model.service_id.hyphenize()}.{operation_name}'
+        started = time.monotonic()
+        sent_bytes = body_size(params.get('body', params.get('Body'))) if operation_model.has_streaming_input else 0
+        error_code = self.backend.injected_error(operation_name)
+        response = None
+        if error_code is None:
+            try:
+                response = handler(**params)
+            except FakeServiceError as error:
+                error_code = error.code
+                message = error.message
+        else:
+            message = 'Injected by the fake backend'
+        received_bytes = 0
+        if response is not None and operation_model.has_streaming_output:
+            body_key = operation_model.output_shape.serialization['payload']
+            data = response[body_key]
+            received_bytes = len(data)
+            response[body_key] = StreamingBody(io.BytesIO(data), len(data))
+        self.backend.transfer(sent_bytes + received_bytes)
+        registry.record(metrics_operation, (time.monotonic() - started) * 1000, sent_bytes + received_bytes, 0,
+                        error_code)
+        if error_code is not None:
+            raise ClientError({'Error': {'Code': error_code, 'Message': message},
+                               'ResponseMetadata': {'HTTPStatusCode': ERROR_STATUS.get(error_code, 400)}},
+                              operation_name)
+        response.setdefault('ResponseMetadata', {}).update({'RequestId': uuid.uuid4().hex, 'RetryAttempts': 0})
+        response['ResponseMetadata'].setdefault('HTTPStatusCode', 200)
+        return response
+
+
+class FakePaginator:
+
+    def __init__(self, operation):
+        self.operation = operation
+
+    def paginate(self, **params):
+        while True:
+            page = self.operation(**params)
+            yield page
+            if not page.get('Marker'):
+                return
+            params = dict(params, marker=page['Marker'])
+
+
+class FakeBucket:
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def download_file(self, Key, Filename):
+        try:
+            body = self.client.get_object(Bucket=self.name, Key=Key)['Body'].read()
+        except ClientError as error:
+            # boto3's transfer manager reports a missing object by its status code.
+            if error.response['Error']['Code'] == 'NoSuchKey':
+                raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+            raise
+        with open(Filename, 'wb') as downloaded_file:
+            downloaded_file.write(body)
+
+
+class FakeResource:
+
+    def __init__(self, client):
+        self.meta = SimpleNamespace(client=client)
+
+    def Bucket(self, name):
+        return FakeBucket(self.meta.client, name)
+
+
+class FakeBackend:
+    # One in-process vault and bucket behind the network conditions in settings, shared by every client handed out.
+
+    def __init__(self, settings=None):
+        self.settings = dict(FAKE_BACKEND_SETTINGS, **environment_settings())
+        self.settings.update(settings or {})
+        self.random = random.Random(self.settings['seed'])
+        # Guards the stored objects only; hashing and the simulated transfer time run outside it.
+        self.lock = threading.RLock()
+        self.glacier = FakeGlacier(self)
+        self.s3 = FakeS3(self)
+        self.resources = {'glacier': FakeResource(FakeClient(self, 'glacier', self.glacier)),
+                          's3': FakeResource(FakeClient(self, 's3', self.s3))}
+
+    def resource(self, service_name):
+        return self.resources[service_name]
+
+    def injected_error(self, operation_name):
+        error_operations = self.settings['error_operations']
+        if not self.settings['error_rate'] or (error_operations is not None and operation_name not in error_operations):
+            return None
+        with self.lock:
+            if self.random.random() >= self.settings['error_rate']:
+                return None
+            return self.random.choice(self.settings['error_codes'])
+
+    def transfer(self, byte_count):
+        # Sleeping outside the lock lets concurrent calls overlap the way parallel connections do.
+        delay = self.settings['latency']
+        if self.settings['bandwidth']:
+            delay += byte_count / self.settings['bandwidth']
+        if delay:
+            time.sleep(delay)
+
+
+def install(settings=None):
+    backend = FakeBackend(settings)
+    aws_clients.set_backend(backend.resource)
+    return backend
+
+
+def uninstall():
+    aws_clients.set_backend(None)
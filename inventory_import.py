@@ -0,0 +1,134 @@
+import codecs
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_SETTINGS = {
+    'read_size': 1024 * 1024,
+    'batch_size': 1000
+}
+
+
+class InventoryFormatError(Exception):
+    pass
+
+
+def iter_inventory_archives(stream, copy_to=None, read_size=None, progress_callback=None, total_size=None):
+    # Yields the ArchiveList entries one at a time, holding at most one read of the inventory in memory.
+    read_size = read_size or INVENTORY_SETTINGS['read_size']
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    read_bytes = 0
+    in_archive_list = False
+    finished_reading = False
+
+    def read_more():
+        nonlocal buffer, position, read_bytes, finished_reading
+        data = stream.read(read_size)
+        if copy_to is not None and data:
+            copy_to.write(data)
+        read_bytes += len(data)
+        if progress_callback is not None:
+            progress_callback(read_bytes, total_size or read_bytes)
+        buffer = buffer[position:] + text_decoder.decode(data, final=not data)
+        position = 0
+        finished_reading = not data
+
+    while True:
+        if not in_archive_list:
+            key_position = buffer.find('"ArchiveList"', position)
+            bracket_position = buffer.find('[', key_position) if key_position != -1 else -1
+            if bracket_position != -1:
+                position = bracket_position + 1
+                in_archive_list = True
+                continue
+            if finished_reading:
+                raise InventoryFormatError('Inventory has no ArchiveList')
+            # Keep enough of the tail for a key split across two reads.
+            position = max(position, len(buffer) - len('"ArchiveList" ['))
+            read_more()
+            continue
+
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            break
+        if position < len(buffer):
+            try:
+                archive, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if finished_reading:
+                    raise InventoryFormatError(f'Malformed ArchiveList entry at character {position}')
+            else:
+                yield archive
+                continue
+        elif finished_reading:
+            raise InventoryFormatError('Inventory ended inside ArchiveList')
+        read_more()
+
+    # Drain the rest of the stream so the copy on disk is the complete inventory.
+    while not finished_reading:
+        read_more()
+
+
+def inventory_entry(archive):
+    return {
+        'id': archive['ArchiveId'],
+        'description': archive.get('ArchiveDescription') or '',
+        'extension': '',
+        'size': f"{archive['Size']/(1024 * 1024)} MB" if 'Size' in archive else '',
+        'size_in_bytes': archive.get('Size'),
+        'creation_date': archive.get('CreationDate'),
+        'sha256_tree_hash': archive.get('SHA256TreeHash')
+    }
+
+
+def import_inventory(stream, catalog, copy_path=None, progress_callback=None, total_size=None):
+    batch_size = INVENTORY_SETTINGS['batch_size']
+    imported_count = 0
+    batch = []
+    # The copy is written next to the last good one and only replaces it once the whole stream has been read.
+    partial_path = copy_path + '.partial' if copy_path else None
+    copy_to = open(partial_path, 'wb') if copy_path else None
+    completed = False
+    try:
+        for archive in iter_inventory_archives(stream, copy_to, progress_callback=progress_callback,
+                                               total_size=total_size):
+            batch.append(inventory_entry(archive))
+            if len(batch) >= batch_size:
+                catalog.upsert_inventory(batch)
+                imported_count += len(batch)
+                batch = []
+        if batch:
+            catalog.upsert_inventory(batch)
+            imported_count += len(batch)
+        completed = True
+    finally:
+        if copy_to is not None:
+            copy_to.close()
+            if completed:
+                os.replace(partial_path, copy_path)
+            else:
+                os.remove(partial_path)
+    logger.info("Imported %s archives from inventory.", imported_count)
+    return imported_count
+
+
+def rebuild_tree_hash_index(stream, catalog):
+    batch_size = INVENTORY_SETTINGS['batch_size']
+    updated_count = 0
+    batch = []
+    for archive in iter_inventory_archives(stream):
+        if archive.get('SHA256TreeHash'):
+            batch.append((archive['ArchiveId'], archive['SHA256TreeHash']))
+        if len(batch) >= batch_size:
+            updated_count += catalog.set_tree_hashes(batch)
+            batch = []
+    if batch:
+        updated_count += catalog.set_tree_hashes(batch)
+    logger.info("Filled in %s content hashes from inventory.", updated_count)
+    return updated_count
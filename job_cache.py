@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+JOB_CACHE_SETTINGS = {
+    'refresh_interval': 300,
+    'full_refresh_interval': 3600
+}
+
+# When an archive has several jobs, a usable one wins over a running one, and a running one over a failed one.
+STATUS_RANK = {'Failed': 0, 'InProgress': 1, 'Succeeded': 2}
+
+
+def job_byte_range(job):
+    # Whole-archive retrievals also report a range, which is normalised away so they share one key.
+    byte_range = job.get('RetrievalByteRange')
+    if not byte_range:
+        return None
+    start, end = (int(value) for value in byte_range.split('-'))
+    if start == 0 and job.get('ArchiveSizeInBytes') is not None and end == job['ArchiveSizeInBytes'] - 1:
+        return None
+    return byte_range
+
+
+def job_output_size(job):
+    byte_range = job_byte_range(job)
+    if byte_range is None:
+        return job['ArchiveSizeInBytes']
+    start, end = (int(value) for value in byte_range.split('-'))
+    return end - start + 1
+
+
+class RetrievalJobCache:
+
+    def __init__(self, client, vault_name, account_id='-', refresh_interval=None, full_refresh_interval=None):
+        self.client = client
+        self.vault_name = vault_name
+        self.account_id = account_id
+        self.refresh_interval = refresh_interval or JOB_CACHE_SETTINGS['refresh_interval']
+        self.full_refresh_interval = full_refresh_interval or JOB_CACHE_SETTINGS['full_refresh_interval']
+        self.lock = threading.RLock()
+        self.jobs = {}
+        self.in_progress_job_ids = set()
+        self.last_refresh = None
+        self.last_full_refresh = None
+
+    def refresh(self, full=False):
+        now = time.monotonic()
+        if full or self.last_full_refresh is None or now - self.last_full_refresh >= self.full_refresh_interval:
+            self.full_refresh()
+            self.last_full_refresh = now
+        else:
+            self.incremental_refresh()
+        self.last_refresh = now
+
+    def maybe_refresh(self):
+        if self.last_refresh is None or time.monotonic() - self.last_refresh >= self.refresh_interval:
+            self.refresh()
+
+    def full_refresh(self):
+        jobs = {}
+        in_progress_job_ids = set()
+        for job in self.list_jobs():
+            self.store(job, jobs, in_progress_job_ids)
+        with self.lock:
+            self.jobs = jobs
+            self.in_progress_job_ids = in_progress_job_ids
+        logger.info("Cached %s jobs of vault %s.", len(jobs), self.vault_name)
+
+    def incremental_refresh(self):
+        # Only running jobs are listed again; jobs that left that list since the last refresh are described once.
+        # The pages are fetched before taking the lock, so lookups from the GUI thread never wait on the network.
+        running_jobs = list(self.list_jobs(completed='false'))
+        with self.lock:
+            for job in running_jobs:
+                self.store(job, self.jobs, self.in_progress_job_ids)
+            finished_job_ids = self.in_progress_job_ids - set(job['JobId'] for job in running_jobs)
+        for job_id in finished_job_ids:
+            job = self.client.describe_job(accountId=self.account_id, vaultName=self.vault_name, jobId=job_id)
+            with self.lock:
+                self.in_progress_job_ids.discard(job_id)
+                self.store(job, self.jobs, self.in_progress_job_ids)
+
+    def list_jobs(self, **filters):
+        paginator = self.client.get_paginator('list_jobs')
+        for page in paginator.paginate(accountId=self.account_id, vaultName=self.vault_name, **filters):
+            yield from page['JobList']
+
+    def store(self, job, jobs, in_progress_job_ids):
+        key = (job.get('ArchiveId'), job['Action'], job_byte_range(job))
+        current_job = jobs.get(key)
+        if job['StatusCode'] == 'InProgress':
+            in_progress_job_ids.add(job['JobId'])
+        if current_job is None or current_job['JobId'] == job['JobId'] or \
+                (STATUS_RANK[job['StatusCode']], job.get('CreationDate', '')) > \
+                (STATUS_RANK[current_job['StatusCode']], current_job.get('CreationDate', '')):
+            jobs[key] = job
+
+    def track_started_job(self, job_id, archive_id, action='ArchiveRetrieval', byte_range=None):
+        with self.lock:
+            self.store({'JobId': job_id, 'ArchiveId': archive_id, 'Action': action, 'RetrievalByteRange': byte_range,
+                        'Completed': False, 'StatusCode': 'InProgress'}, self.jobs, self.in_progress_job_ids)
+
+    def get(self, archive_id, action='ArchiveRetrieval', byte_range=None):
+        with self.lock:
+            return self.jobs.get((archive_id, action, byte_range))
+
+    def status(self, archive_id, byte_range=None):
+        job = self.get(archive_id, byte_range=byte_range)
+        if job is None or job['StatusCode'] == 'Failed':
+            return False, False
+        return job['StatusCode'] == 'Succeeded', True
@@ -1,26 +1,22 @@
-import json
 import logging
 import os
 import sys
 
-import boto3
 from PyQt6 import QtWidgets, uic
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import QMessageBox
-from botocore.exceptions import ClientError
 
 from ArchivesTable import ArchivesTable
+from MetricsStatusLabel import MetricsStatusLabel
+from ProgressWindow import ProgressWindow
+from archive_catalog import ArchiveCatalog
+from archive_service import ArchiveService
+from metrics import setup_logging, stop_logging
+from pack_archive import plan_packs
+from task_scheduler import TaskScheduler
 
 logger = logging.getLogger(__name__)
 
-CREDENTIALS = {
-    'access_key_id': 'access-key-id',
-    'secret_access_key': 'secret-access-key',
-    'vault_name': 'name',
-    'account_id': 'id',
-    'region': 'region',
-    'bucket': 'bucket-name'
-}
-
 basedir = os.path.dirname(__file__)
 
 
@@ -30,13 +26,18 @@ class MainWindow(QtWidgets.QMainWindow):
         super(MainWindow, self).__init__()
         self.loadUi()
         self.setWindowTitle('AWS Glacier Archive app')
-
-        self.glacier = boto3.resource('glacier',
-                                      region_name=CREDENTIALS['region'],
-                                      aws_access_key_id=CREDENTIALS['access_key_id'],
-                                      aws_secret_access_key=CREDENTIALS['secret_access_key'])
-        self.vault = self.glacier.Vault(CREDENTIALS['account_id'], CREDENTIALS['vault_name'])
-        self.archives_table_window = ArchivesTable(self.glacier, self.vault, self)
+        self.metrics_label = MetricsStatusLabel(self.statusbar)
+
+        self.catalog = ArchiveCatalog(os.path.join(basedir, 'storage/archives.db'))
+        self.archive_service = ArchiveService(self.catalog)
+        self.scheduler = TaskScheduler(parent=self)
+        self.scheduler.queue_changed.connect(self.show_queue_status)
+        self.upload_progress_window = ProgressWindow(self.scheduler, self)
+        # The Archives Table lists jobs and pulls the catalog from S3, so it is only built when first opened.
+        self.archives_table_window = None
+        if self.catalog.pending_retrievals()[0]:
+            # Queued retrievals keep running unattended, so their table is built as soon as the app is up.
+            QTimer.singleShot(0, self.get_archives_table_window)
         self.archive_files_btn.clicked.connect(self.select_files_to_upload)
         self.retrieve_file_btn.clicked.connect(self.show_list_of_archives)
         self.retrieve_files_btn.clicked.connect(self.start_retrieve_job)
@@ -46,26 +47,55 @@ class MainWindow(QtWidgets.QMainWindow):
         uic.loadUi(os.path.join(basedir, 'storage/ui/aws_archive.ui'), self)
 
     def select_files_to_upload(self):
-        file_name = QtWidgets.QFileDialog.getOpenFileName(self,
-                                                          'Select File(s) to upload',
-                                                          options=QtWidgets.QFileDialog.Option.DontUseNativeDialog)
-        if file_name[0] != '':
-            self.upload_archive(file_name[0])
-
-    def upload_archive(self, file_to_archive):
+        file_names = QtWidgets.QFileDialog.getOpenFileNames(self,
+                                                            'Select File(s) to upload',
+                                                            options=QtWidgets.QFileDialog.Option.DontUseNativeDialog)
+        if len(file_names[0]) == 1:
+            self.upload_archive(file_names[0][0])
+        elif len(file_names[0]) > 1:
+            description, ok = QtWidgets.QInputDialog.getText(self, 'Archive Description',
+                                                             'Enter a description for all files (recommended):')
+            if self.pack_mode_checkbox.isChecked():
+                packs, single_files = plan_packs(file_names[0])
+            else:
+                packs, single_files = [], file_names[0]
+            common_directory = os.path.commonpath(file_names[0])
+            for pack in packs:
+                self.upload_pack(pack, description, [os.path.relpath(path, common_directory) for path in pack])
+            for file_to_archive in single_files:
+                self.upload_archive(file_to_archive, description)
+
+    def upload_archive(self, file_to_archive, description=None):
         print(file_to_archive)
         file_size = os.stat(file_to_archive).st_size
-        description, ok = QtWidgets.QInputDialog.getText(self, 'Archive Description',
-                                                         'Enter a description (recommended):')
+        if description is None:
+            description, ok = QtWidgets.QInputDialog.getText(self, 'Archive Description',
+                                                             'Enter a description (recommended):')
+        task = self.scheduler.submit('upload', self.upload_archive_task, file_to_archive, description,
+                                     title=f'Upload {os.path.basename(file_to_archive)}',
+                                     on_done=lambda archive_array: self.on_archive_uploaded(file_to_archive, archive_array),
+                                     on_error=self.show_task_error)
+        self.upload_progress_window.track(task, file_size)
+
+    def on_archive_uploaded(self, file_to_archive, archive_array):
+        if archive_array:
+            self.add_to_archives_json(archive_array)
+        else:
+            self.statusbar.showMessage(f'{os.path.basename(file_to_archive)} is already in the vault, upload skipped')
 
-        with open(file_to_archive, 'rb') as upload_file:
-            if file_size/(1024 * 1024) < 100:
-                archive = self.vault.upload_archive(body=upload_file)
-            else:
-                archive = self.big_archive_upload(file_to_archive)
-        file_extension = os.path.splitext(file_to_archive)[1]
-        new_archive_entry = [{"id": archive.id, "description": description, "extension": file_extension, "size": f"{file_size/(1024 * 1024)} MB"}]
-        self.add_to_archives_json(new_archive_entry)
+    def upload_pack(self, files_to_archive, description, member_descriptions=None):
+        pack_size = sum(os.stat(file_to_archive).st_size for file_to_archive in files_to_archive)
+        task = self.scheduler.submit('upload', self.upload_pack_task, files_to_archive, description, member_descriptions,
+                                     title=f'Upload pack of {len(files_to_archive)} files',
+                                     on_done=self.add_to_archives_json, on_error=self.show_task_error)
+        self.upload_progress_window.track(task, pack_size)
+
+    def upload_archive_task(self, task, file_to_archive, description):
+        return self.archive_service.upload_archive(file_to_archive, description, task.report_progress)
+
+    def upload_pack_task(self, task, files_to_archive, description, member_descriptions):
+        return self.archive_service.upload_pack(files_to_archive, description, task.report_progress,
+                                                member_descriptions)
 
     def start_retrieve_job(self):
         confirmation = QMessageBox.question(self,
@@ -75,13 +105,20 @@ class MainWindow(QtWidgets.QMainWindow):
                                             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.Cancel,
                                             QMessageBox.StandardButton.Cancel)
         if confirmation == QMessageBox.StandardButton.Yes:
-            self.vault.initiate_inventory_retrieval()
+            self.scheduler.submit('retrieval', self.initiate_inventory_retrieval, title='Start inventory retrieval',
+                                  on_error=self.show_task_error)
+
+    def initiate_inventory_retrieval(self, task):
+        return self.archive_service.initiate_inventory_retrieval()
 
     def download_most_recent_job_output(self):
-        most_recent_inventory_retrieval_job = None
-        for job in self.vault.succeeded_jobs.all():
-            if job.action == 'InventoryRetrieval':
-                most_recent_inventory_retrieval_job = job
+        self.scheduler.submit('jobs', self.find_most_recent_inventory_job, title='Find inventory job',
+                              on_done=self.on_inventory_job_found, on_error=self.show_task_error)
+
+    def find_most_recent_inventory_job(self, task):
+        return self.archive_service.find_most_recent_inventory_job()
+
+    def on_inventory_job_found(self, most_recent_inventory_retrieval_job):
         if most_recent_inventory_retrieval_job is None:
             QMessageBox.question(self,
                                  'Something went wrong',
@@ -94,64 +131,71 @@ class MainWindow(QtWidgets.QMainWindow):
                                  'The most recent inventory will now begin downloading.',
                                  QMessageBox.StandardButton.Ok,
                                  QMessageBox.StandardButton.Ok)
-            output = self.get_job_output(most_recent_inventory_retrieval_job)
-            with open(os.path.join(basedir, 'storage/inventory.json'), 'w') as json_output_file:
-                json_output = json.loads(output)
-                json_formatted_output = json.dumps(json_output, indent=4, sort_keys=True)
-                json_output_file.write(json_formatted_output)
-                new_archive_entries = []
-                for archive in json_output['ArchiveList']:
-                    new_archive_entries.append(
-                        {'id': archive['ArchiveId'], 'description': archive['ArchiveDescription'], "extension": ""})
-                self.add_to_archives_json(new_archive_entries)
-            QMessageBox.question(self,
-                                 'Download has finished',
-                                 'Inventory has been downloaded. Check the Archives Table to manage your archives.',
-                                 QMessageBox.StandardButton.Ok,
-                                 QMessageBox.StandardButton.Ok)
-
-    def big_archive_upload(self, file_to_archive):
-        pass
-
-    def get_job_output(self, job):
-        try:
-            response = job.get_output()
-            out_bytes = response['body'].read()
-            logger.info("Read %s bytes from job %s.", len(out_bytes), job.id)
-            if 'archiveDescription' in response:
-                logger.info(
-                    "These bytes are described as '%s'", response['archiveDescription'])
-        except ClientError:
-            logger.exception("Couldn't get output for job %s.", job.id)
-            raise
-        else:
-            return out_bytes
+            self.scheduler.submit('inventory', self.download_inventory, most_recent_inventory_retrieval_job,
+                                  title='Download inventory', on_done=self.on_inventory_downloaded,
+                                  on_error=self.show_task_error)
+
+    def download_inventory(self, task, job):
+        return self.archive_service.download_inventory(job, task.report_progress)
+
+    def on_inventory_downloaded(self, imported_count):
+        self.schedule_catalog_sync()
+        if self.archives_table_window is not None:
+            self.archives_table_window.update_table()
+        QMessageBox.question(self,
+                             'Download has finished',
+                             'Inventory has been downloaded. Check the Archives Table to manage your archives.',
+                             QMessageBox.StandardButton.Ok,
+                             QMessageBox.StandardButton.Ok)
+
+    def get_archives_table_window(self):
+        if self.archives_table_window is None:
+            self.archives_table_window = ArchivesTable(self, self.archive_service, self.scheduler)
+        return self.archives_table_window
 
     def show_list_of_archives(self):
-        self.archives_table_window.show()
+        self.get_archives_table_window().show()
 
     def retrieve_single_archive(self, archive_id):
-        archive = self.glacier.Archive(CREDENTIALS['account_id'], CREDENTIALS['vault_name'], archive_id)
-        archive.initiate_archive_retrieval()
+        self.get_archives_table_window().start_archive_retrieval_job(archive_id)
 
     def add_to_archives_json(self, archive_array):
-        with open(os.path.join(basedir, 'storage/archives.json'), 'r') as archives:
-            past_archives = json.load(archives)
-            for archive in archive_array:
-                past_archives.append(archive)
-        with open(os.path.join(basedir, 'storage/archives.json'), 'w') as archives:
-            json.dump(past_archives, archives)
-        response = self.archives_table_window.s3.Bucket(CREDENTIALS['bucket']).upload_file(os.path.join(basedir, 'storage/archives.json'),
-                                                                                           'archives.json')
-        with open(os.path.join(basedir, f'storage/logs/replaced_file_of_bucket_{CREDENTIALS["bucket"]}_response_log.txt'), 'a') as delete_log:
-            json_formatted_output = json.dumps(response, indent=4, sort_keys=True)
-            delete_log.write(json_formatted_output)
-        self.archives_table_window.update_table()
+        self.catalog.add(archive_array)
+        self.schedule_catalog_sync()
+        if self.archives_table_window is not None:
+            self.archives_table_window.add_table_rows(archive_array)
+
+    def schedule_catalog_load(self, on_done=None):
+        self.scheduler.submit('sync', lambda task: self.archive_service.load_catalog_from_s3(), title='Load archives catalog',
+                              on_done=on_done, on_error=self.show_task_error)
+
+    def schedule_catalog_sync(self):
+        self.scheduler.submit('sync', lambda task: self.archive_service.sync_catalog_to_s3(), title='Sync archives catalog',
+                              on_error=self.show_task_error)
+
+    def show_queue_status(self, running_count, queued_count):
+        if running_count or queued_count:
+            self.statusbar.showMessage(f'{running_count} task(s) running, {queued_count} queued')
+        else:
+            self.statusbar.clearMessage()
+
+    def show_task_error(self, error):
+        QMessageBox.question(self,
+                             'Something went wrong',
+                             str(error),
+                             QMessageBox.StandardButton.Ok,
+                             QMessageBox.StandardButton.Ok)
+
+    def closeEvent(self, event):
+        self.scheduler.shutdown()
+        super(MainWindow, self).closeEvent(event)
 
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
+    setup_logging()
     app = QtWidgets.QApplication(sys.argv)
     win = MainWindow()
     win.show()
     app.exec()
+    stop_logging()
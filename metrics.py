@@ -0,0 +1,251 @@
+import bisect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_SETTINGS = {
+    # Upper bounds of the latency histogram buckets, in milliseconds; slower calls land in a last, open bucket.
+    'latency_buckets_ms': [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000],
+    'log_path': 'storage/logs/operations.jsonl',
+    'log_max_bytes': 10 * 1024 * 1024,
+    'log_backup_count': 5
+}
+
+basedir = os.path.dirname(__file__)
+
+
+class OperationStats:
+
+    def __init__(self, bucket_bounds):
+        self.bucket_bounds = bucket_bounds
+        self.latency_counts = [0] * (len(bucket_bounds) + 1)
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.total_latency_ms = 0.0
+
+    def add(self, latency_ms, byte_count, retries, error):
+        self.latency_counts[bisect.bisect_left(self.bucket_bounds, latency_ms)] += 1
+        self.count += 1
+        self.errors += 1 if error else 0
+        self.retries += retries
+        self.bytes += byte_count
+        self.total_latency_ms += latency_ms
+
+    def percentile(self, fraction):
+        # Reported as the upper bound of the bucket holding the percentile, which is as precise as the histogram.
+        threshold = fraction * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.latency_counts):
+            seen += bucket_count
+            if bucket_count and seen >= threshold:
+                return self.bucket_bounds[i] if i < len(self.bucket_bounds) else float('inf')
+        return 0
+
+    def as_dict(self):
+        return {'count': self.count, 'errors': self.errors, 'retries': self.retries, 'bytes': self.bytes,
+                'mean_latency_ms': round(self.total_latency_ms / self.count, 1) if self.count else 0,
+                'p50_latency_ms': self.percentile(0.5), 'p95_latency_ms': self.percentile(0.95),
+                'bytes_per_second': round(self.bytes * 1000 / self.total_latency_ms) if self.total_latency_ms else 0,
+                'latency_histogram_ms': dict(zip([str(bound) for bound in self.bucket_bounds] + ['inf'],
+                                                 self.latency_counts))}
+
+
+class MetricsRegistry:
+
+    def __init__(self, bucket_bounds=None):
+        self.bucket_bounds = bucket_bounds or METRICS_SETTINGS['latency_buckets_ms']
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.started = time.monotonic()
+
+    def record(self, operation, latency_ms, byte_count=0, retries=0, error=None):
+        with self.lock:
+            stats = self.operations.get(operation)
+            if stats is None:
+                stats = self.operations[operation] = OperationStats(self.bucket_bounds)
+            stats.add(latency_ms, byte_count, retries, error)
+        logger.info("%s took %.0f ms", operation, latency_ms,
+                    extra={'fields': {'event': 'api_call', 'operation': operation, 'latency_ms': round(latency_ms, 1),
+                                      'bytes': byte_count, 'retries': retries, 'error': error}})
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.started = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            return {operation: stats.as_dict() for operation, stats in sorted(self.operations.items())}
+
+    def totals(self):
+        with self.lock:
+            stats = self.operations.values()
+            return {'count': sum(s.count for s in stats), 'errors': sum(s.errors for s in stats),
+                    'retries': sum(s.retries for s in stats), 'bytes': sum(s.bytes for s in stats),
+                    'p95_latency_ms': max([s.percentile(0.95) for s in stats] or [0])}
+
+    def summary_text(self, bytes_per_second=None):
+        totals = self.totals()
+        text = (f"{totals['count']} API calls, {totals['errors']} errors, {totals['retries']} retries, "
+                f"p95 {totals['p95_latency_ms']} ms")
+        if bytes_per_second is not None:
+            text += f', {bytes_per_second/(1024 * 1024):.1f} MB/s'
+        return text
+
+    def report_lines(self):
+        lines = []
+        for operation, stats in self.snapshot().items():
+            lines.append(f"{operation:40} {stats['count']:7} calls {stats['errors']:5} errors {stats['retries']:5} retries "
+                         f"p50 {stats['p50_latency_ms']:>6} ms p95 {stats['p95_latency_ms']:>6} ms "
+                         f"{stats['bytes']/(1024 * 1024):10.1f} MB {stats['bytes_per_second']/(1024 * 1024):8.2f} MB/s")
+        return lines
+
+
+registry = MetricsRegistry()
+
+
+def body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    if hasattr(body, 'seek') and hasattr(body, 'tell'):
+        position = body.tell()
+        body.seek(0, os.SEEK_END)
+        size = body.tell() - position
+        body.seek(position)
+        return size
+    return 0
+
+
+def before_call(model, params, context, **kwargs):
+    # Latency is measured around the whole call, so it includes the retries botocore makes inside it.
+    context['metrics_operation'] = f'{model.service_model.service_id.hyphenize()}.{model.name}'
+    context['metrics_started'] = time.monotonic()
+    context['metrics_sent_bytes'] = body_size(params.get('body')) if model.has_streaming_input else 0
+
+
+class MeteredStreamingBody:
+    # after-call fires once the headers arrive, so a download is recorded when its body has been read to the end.
+
+    def __init__(self, body, operation, started, sent_bytes, retries):
+        self.body = body
+        self.operation = operation
+        self.started = started
+        self.sent_bytes = sent_bytes
+        self.retries = retries
+        self.received_bytes = 0
+        self.recorded = False
+
+    def read(self, amt=None):
+        data = self.body.read(amt)
+        self.received_bytes += len(data)
+        if amt is None or not data:
+            self.finish()
+        return data
+
+    def iter_chunks(self, chunk_size=1024):
+        return iter(lambda: self.read(chunk_size), b'')
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def close(self):
+        self.finish()
+        self.body.close()
+
+    def finish(self):
+        if not self.recorded:
+            self.recorded = True
+            registry.record(self.operation, (time.monotonic() - self.started) * 1000,
+                            self.sent_bytes + self.received_bytes, self.retries)
+
+    def __getattr__(self, name):
+        return getattr(self.body, name)
+
+
+def after_call(http_response, parsed, model, context, **kwargs):
+    if 'metrics_started' not in context:
+        return
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    payload = model.output_shape.serialization.get('payload') if model.has_streaming_output else None
+    if http_response.status_code < 300 and parsed.get(payload) is not None:
+        parsed[payload] = MeteredStreamingBody(parsed[payload], context['metrics_operation'],
+                                               context['metrics_started'], context['metrics_sent_bytes'], retries)
+        return
+    latency_ms = (time.monotonic() - context['metrics_started']) * 1000
+    error = parsed.get('Error', {}).get('Code') if http_response.status_code >= 300 else None
+    registry.record(context['metrics_operation'], latency_ms, context['metrics_sent_bytes'], retries, error)
+
+
+def after_call_error(exception, context, **kwargs):
+    if 'metrics_started' not in context:
+        return
+    latency_ms = (time.monotonic() - context['metrics_started']) * 1000
+    registry.record(context['metrics_operation'], latency_ms, 0, 0, type(exception).__name__)
+
+
+def instrument_session(session):
+    # Clients copy the session's event handlers when they are created, so this has to run before the first client.
+    session.events.register('before-call', before_call, unique_id='metrics-before-call')
+    session.events.register('after-call', after_call, unique_id='metrics-after-call')
+    session.events.register('after-call-error', after_call_error, unique_id='metrics-after-call-error')
+
+
+class JsonLinesFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'), 'level': record.levelname,
+                 'logger': record.name, 'message': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+listener = None
+
+
+def setup_logging(level=logging.INFO, console_level=None, log_path=None):
+    # Records are handed to a queue and written by a listener thread, so callers never wait on the disk.
+    global listener
+    if listener is not None:
+        return listener
+    log_path = os.path.join(basedir, log_path or METRICS_SETTINGS['log_path'])
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=METRICS_SETTINGS['log_max_bytes'],
+                                                        backupCount=METRICS_SETTINGS['log_backup_count'])
+    file_handler.setFormatter(JsonLinesFormatter())
+    file_handler.setLevel(level)
+    handlers = [file_handler]
+    if console_level is not None:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        console_handler.setLevel(console_level)
+        handlers.append(console_handler)
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(min(level, console_level if console_level is not None else level))
+    # botocore logs every request at debug level, which would drown the operation records.
+    logging.getLogger('botocore').setLevel(logging.WARNING)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop_logging():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
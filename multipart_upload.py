@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from botocore.exceptions import ClientError
+
+from tree_hash import MEGABYTE, TreeHash, combine_tree_hashes
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SETTINGS = {
+    'part_size': 64 * MEGABYTE,
+    'max_workers': 4,
+    'max_in_flight_bytes': 512 * MEGABYTE
+}
+
+# Glacier limits: part sizes are 1 MiB * 2^n up to 4 GiB, with at most 10,000 parts per upload.
+MAX_PART_SIZE = 4096 * MEGABYTE
+MAX_PARTS = 10000
+
+basedir = os.path.dirname(__file__)
+
+
+def choose_part_size(file_size, part_size=UPLOAD_SETTINGS['part_size']):
+    if part_size < MEGABYTE or part_size > MAX_PART_SIZE or part_size & (part_size - 1):
+        raise ValueError(f'Invalid part size {part_size}: must be 1 MiB multiplied by a power of two, up to 4 GiB')
+    while math.ceil(file_size / part_size) > MAX_PARTS:
+        part_size *= 2
+        if part_size > MAX_PART_SIZE:
+            raise ValueError(f'File of {file_size} bytes is too large for a multipart upload')
+    return part_size
+
+
+class MultipartUploader:
+
+    def __init__(self, client, vault_name, account_id='-', part_size=None, max_workers=None,
+                 max_in_flight_bytes=None, state_dir=None):
+        self.client = client
+        self.vault_name = vault_name
+        self.account_id = account_id
+        self.part_size = part_size or UPLOAD_SETTINGS['part_size']
+        self.max_workers = max_workers or UPLOAD_SETTINGS['max_workers']
+        self.max_in_flight_bytes = max_in_flight_bytes or UPLOAD_SETTINGS['max_in_flight_bytes']
+        self.state_dir = state_dir or os.path.join(basedir, 'storage/uploads')
+        self.state_lock = threading.Lock()
+
+    def upload(self, file_path, description='', tree_hash=None, progress_callback=None):
+        stat = os.stat(file_path)
+        part_size = choose_part_size(stat.st_size, self.part_size)
+        state_path = self.get_state_path(file_path)
+        state = self.resume_state(state_path, stat, part_size)
+        if state is None:
+            response = self.client.initiate_multipart_upload(accountId=self.account_id,
+                                                             vaultName=self.vault_name,
+                                                             archiveDescription=description,
+                                                             partSize=str(part_size))
+            state = {'upload_id': response['uploadId'], 'size': stat.st_size, 'mtime': stat.st_mtime,
+                     'part_size': part_size, 'parts': {}}
+            self.save_state(state_path, state)
+            logger.info("Started multipart upload %s for %s.", state['upload_id'], file_path)
+
+        part_count = math.ceil(stat.st_size / part_size)
+        pending_parts = [i for i in range(part_count) if str(i) not in state['parts']]
+        self.progress_callback = progress_callback
+        self.uploaded_bytes = sum(min(part_size, stat.st_size - int(i) * part_size) for i in state['parts'])
+        if progress_callback is not None:
+            progress_callback(self.uploaded_bytes, stat.st_size)
+        logger.info("Uploading %s of %s parts of %s.", len(pending_parts), part_count, file_path)
+
+        # Every queued part holds a slot until Glacier acknowledges it, which caps the bytes read into memory.
+        in_flight_slots = threading.BoundedSemaphore(max(1, self.max_in_flight_bytes // part_size))
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for part_index in pending_parts:
+                in_flight_slots.acquire()
+                if any(future.done() and future.exception() for future in futures):
+                    in_flight_slots.release()
+                    break
+                future = executor.submit(self.upload_part, file_path, state, state_path, part_index, tree_hash)
+                future.add_done_callback(lambda _: in_flight_slots.release())
+                futures.append(future)
+            wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            if future.exception():
+                logger.error("Multipart upload of %s interrupted, it will resume from %s acknowledged parts.",
+                             file_path, len(state['parts']))
+                raise future.exception()
+
+        checksum = combine_tree_hashes(bytes.fromhex(state['parts'][str(i)]) for i in range(part_count)).hex()
+        response = self.client.complete_multipart_upload(accountId=self.account_id,
+                                                         vaultName=self.vault_name,
+                                                         uploadId=state['upload_id'],
+                                                         archiveSize=str(stat.st_size),
+                                                         checksum=checksum)
+        os.remove(state_path)
+        return response['archiveId']
+
+    def upload_part(self, file_path, state, state_path, part_index, tree_hash=None):
+        start = part_index * state['part_size']
+        with open(file_path, 'rb') as upload_file:
+            upload_file.seek(start)
+            body = upload_file.read(state['part_size'])
+        end = start + len(body) - 1
+        # Without a precomputed tree hash each part is hashed as it is read, so the file is only read once.
+        if tree_hash is None:
+            part_checksum = TreeHash.from_buffer(body).hexdigest()
+        else:
+            part_checksum = tree_hash.range_hexdigest(start, len(body))
+        self.client.upload_multipart_part(accountId=self.account_id,
+                                          vaultName=self.vault_name,
+                                          uploadId=state['upload_id'],
+                                          checksum=part_checksum,
+                                          range=f'bytes {start}-{end}/*',
+                                          body=body)
+        with self.state_lock:
+            state['parts'][str(part_index)] = part_checksum
+            self.save_state(state_path, state)
+            self.uploaded_bytes += len(body)
+            uploaded_bytes = self.uploaded_bytes
+        if self.progress_callback is not None:
+            self.progress_callback(uploaded_bytes, state['size'])
+
+    def resume_state(self, state_path, stat, part_size):
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path, 'r') as state_file:
+            try:
+                state = json.load(state_file)
+            except ValueError:
+                logger.warning("Ignoring unreadable upload state %s.", state_path)
+                return None
+        if state['size'] != stat.st_size or state['mtime'] != stat.st_mtime or state['part_size'] != part_size:
+            logger.info("File changed since upload %s was started, starting over.", state['upload_id'])
+            self.abort(state['upload_id'])
+            return None
+        try:
+            state['parts'] = self.list_acknowledged_parts(state['upload_id'], state['part_size'])
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ResourceNotFoundException':
+                logger.info("Upload %s has expired, starting over.", state['upload_id'])
+                return None
+            raise
+        logger.info("Resuming upload %s with %s acknowledged parts.", state['upload_id'], len(state['parts']))
+        return state
+
+    def list_acknowledged_parts(self, upload_id, part_size):
+        parts = {}
+        paginator = self.client.get_paginator('list_parts')
+        for page in paginator.paginate(accountId=self.account_id, vaultName=self.vault_name, uploadId=upload_id):
+            for part in page['Parts']:
+                start = int(part['RangeInBytes'].split('-')[0])
+                parts[str(start // part_size)] = part['SHA256TreeHash']
+        return parts
+
+    def abort(self, upload_id):
+        try:
+            self.client.abort_multipart_upload(accountId=self.account_id, vaultName=self.vault_name, uploadId=upload_id)
+        except ClientError:
+            logger.exception("Couldn't abort multipart upload %s.", upload_id)
+
+    def get_state_path(self, file_path):
+        key = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.state_dir, f'{key}.json')
+
+    def save_state(self, state_path, state):
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        temporary_path = state_path + '.tmp'
+        with open(temporary_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(temporary_path, state_path)
@@ -0,0 +1,69 @@
+import os
+import shutil
+
+from tree_hash import MEGABYTE
+
+PACK_SETTINGS = {
+    'max_member_size': 16 * MEGABYTE,
+    'max_pack_size': 1024 * MEGABYTE
+}
+
+COPY_BUFFER_SIZE = MEGABYTE
+
+
+def plan_packs(file_paths, max_member_size=None, max_pack_size=None):
+    # Splits the selection into groups of small files, one group per pack, and files uploaded on their own.
+    max_member_size = max_member_size or PACK_SETTINGS['max_member_size']
+    max_pack_size = max_pack_size or PACK_SETTINGS['max_pack_size']
+    packs = []
+    single_files = []
+    current_pack = []
+    current_size = 0
+    for file_path in file_paths:
+        file_size = os.stat(file_path).st_size
+        if file_size > max_member_size:
+            single_files.append(file_path)
+            continue
+        if current_pack and current_size + file_size > max_pack_size:
+            packs.append(current_pack)
+            current_pack = []
+            current_size = 0
+        current_pack.append(file_path)
+        current_size += file_size
+    if len(current_pack) > 1:
+        packs.append(current_pack)
+    else:
+        single_files.extend(current_pack)
+    return packs, single_files
+
+
+def build_pack(file_paths, pack_path):
+    members = []
+    with open(pack_path, 'wb') as pack_file:
+        for file_path in file_paths:
+            offset = pack_file.tell()
+            with open(file_path, 'rb') as member_file:
+                shutil.copyfileobj(member_file, pack_file, COPY_BUFFER_SIZE)
+            members.append({'path': file_path, 'offset': offset, 'length': pack_file.tell() - offset})
+    return members
+
+
+def member_byte_range(offset, length, pack_size):
+    # Glacier only accepts ranges that start on a 1 MiB boundary and end on one or at the end of the archive.
+    start = offset - offset % MEGABYTE
+    end = min(-(-(offset + length) // MEGABYTE) * MEGABYTE, pack_size) - 1
+    if start == 0 and end == pack_size - 1:
+        return None
+    return f'{start}-{end}'
+
+
+def extract_member(range_path, range_start, offset, length, target_path):
+    with open(range_path, 'rb') as range_file, open(target_path, 'wb') as target_file:
+        range_file.seek(offset - range_start)
+        remaining = length
+        while remaining:
+            data = range_file.read(min(COPY_BUFFER_SIZE, remaining))
+            if not data:
+                raise IOError(f'Retrieved range of {range_path} ends before the member at offset {offset}')
+            target_file.write(data)
+            remaining -= len(data)
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_TIERS = ['Expedited', 'Standard', 'Bulk']
+
+RETRIEVAL_SETTINGS = {
+    'default_tier': 'Standard',
+    'initiations_per_second': 2,
+    'burst': 10,
+    # Each provisioned capacity unit guarantees at least three expedited retrievals every five minutes.
+    'expedited_per_capacity_unit': 3,
+    'capacity_window': 300,
+    'retry_delay': 30,
+    'max_attempts': 8,
+    # How often a run waiting on deferred requests checks whether it was cancelled.
+    'cancel_check_interval': 0.5
+}
+
+RETRYABLE_CODES = ['ThrottlingException', 'LimitExceededException', 'RequestTimeoutException',
+                   'ServiceUnavailableException', 'InsufficientCapacityException']
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        # Takes a token if one is available, otherwise returns how long to wait before asking again.
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class RetrievalScheduler:
+
+    def __init__(self, client, vault_name, account_id, catalog, job_cache, initiations_per_second=None, burst=None):
+        self.client = client
+        self.vault_name = vault_name
+        self.account_id = account_id
+        self.catalog = catalog
+        self.job_cache = job_cache
+        self.bucket = TokenBucket(initiations_per_second or RETRIEVAL_SETTINGS['initiations_per_second'],
+                                  burst or RETRIEVAL_SETTINGS['burst'])
+        self.expedited_starts = deque()
+        # Set by enqueue, so a run waiting out a deferred request starts new ones right away.
+        self.wakeup = threading.Event()
+
+    def enqueue(self, targets, tier=None):
+        # Requests for a range that already has a job, or is already queued, are folded into that job or request.
+        tier = tier or RETRIEVAL_SETTINGS['default_tier']
+        now = time.time()
+        requests = []
+        coalesced_count = 0
+        targets = list(dict.fromkeys(targets))
+        for archive_id, byte_range in targets:
+            if self.job_cache.status(archive_id, byte_range)[1]:
+                coalesced_count += 1
+                continue
+            request = self.catalog.get_retrieval(archive_id, byte_range)
+            if request is not None and request['status'] == 'queued':
+                coalesced_count += 1
+                if RETRIEVAL_TIERS.index(tier) >= RETRIEVAL_TIERS.index(request['tier']):
+                    continue
+                request['tier'] = tier
+            else:
+                request = {'archive_id': archive_id, 'byte_range': byte_range, 'tier': tier, 'status': 'queued',
+                           'requested_at': now, 'not_before': 0, 'attempts': 0, 'error': None}
+            requests.append(request)
+        self.catalog.put_retrievals(requests)
+        if requests:
+            self.wakeup.set()
+        return len(targets) - coalesced_count, coalesced_count
+
+    def is_queued(self, archive_id, byte_range=None):
+        request = self.catalog.get_retrieval(archive_id, byte_range)
+        return request is not None and request['status'] == 'queued'
+
+    def pending_count(self):
+        return self.catalog.pending_retrievals()[0]
+
+    def run(self, progress_callback=None, cancel_event=None, wait_for_deferred=True):
+        # Works through the queue until it is empty or cancelled, waiting out throttling and capacity limits in between.
+        cancel_event = cancel_event or threading.Event()
+        self.job_cache.maybe_refresh()
+        capacity_units = self.provisioned_capacity_units()
+        started_count = 0
+        failed = {}
+        while True:
+            self.wakeup.clear()
+            requests = self.catalog.due_retrievals(time.time())
+            if not requests:
+                pending_count, not_before = self.catalog.pending_retrievals()
+                if not pending_count or not wait_for_deferred:
+                    break
+                while not cancel_event.is_set() and time.time() < not_before and \
+                        not self.wakeup.wait(min(RETRIEVAL_SETTINGS['cancel_check_interval'], not_before - time.time())):
+                    pass
+                if cancel_event.is_set():
+                    break
+                continue
+            for request in requests:
+                if cancel_event.is_set():
+                    break
+                if progress_callback is not None:
+                    progress_callback(started_count, started_count + self.pending_count())
+                if self.job_cache.status(request['archive_id'], request['byte_range'])[1]:
+                    self.catalog.remove_retrieval(request['archive_id'], request['byte_range'])
+                    continue
+                if request['tier'] == 'Expedited':
+                    expedited_delay = self.expedited_delay(capacity_units)
+                    if expedited_delay:
+                        self.catalog.put_retrievals([dict(request, not_before=time.time() + expedited_delay)])
+                        continue
+                delay = self.bucket.take()
+                while delay and not cancel_event.wait(delay):
+                    delay = self.bucket.take()
+                if delay:
+                    break
+                if self.initiate(request, failed):
+                    started_count += 1
+            if cancel_event.is_set():
+                break
+        return started_count, failed
+
+    def initiate(self, request, failed):
+        job_parameters = {'Type': 'archive-retrieval', 'ArchiveId': request['archive_id'], 'Tier': request['tier']}
+        if request['byte_range'] is not None:
+            job_parameters['RetrievalByteRange'] = request['byte_range']
+        try:
+            response = self.client.initiate_job(accountId=self.account_id, vaultName=self.vault_name,
+                                                jobParameters=job_parameters)
+        except (ClientError, BotoCoreError) as error:
+            code = error.response['Error']['Code'] if isinstance(error, ClientError) else None
+            attempts = request['attempts'] + 1
+            if (code is None or code in RETRYABLE_CODES) and attempts < RETRIEVAL_SETTINGS['max_attempts']:
+                delay = RETRIEVAL_SETTINGS['capacity_window'] if code == 'InsufficientCapacityException' else \
+                    RETRIEVAL_SETTINGS['retry_delay'] * 2 ** request['attempts']
+                logger.info("Retrieval of %s deferred by %ss: %s", request['archive_id'], delay, error)
+                self.catalog.put_retrievals([dict(request, attempts=attempts, not_before=time.time() + delay,
+                                                  error=str(error))])
+            else:
+                logger.error("Retrieval of %s failed: %s", request['archive_id'], error)
+                self.catalog.put_retrievals([dict(request, attempts=attempts, status='failed', error=str(error))])
+                failed[request['archive_id']] = str(error)
+            return False
+        if request['tier'] == 'Expedited':
+            self.expedited_starts.append(time.monotonic())
+        self.job_cache.track_started_job(response['jobId'], request['archive_id'], byte_range=request['byte_range'])
+        self.catalog.remove_retrieval(request['archive_id'], request['byte_range'])
+        return True
+
+    def expedited_delay(self, capacity_units):
+        # Without provisioned capacity expedited requests run on demand and may be refused with InsufficientCapacity.
+        if not capacity_units:
+            return 0
+        window = RETRIEVAL_SETTINGS['capacity_window']
+        while self.expedited_starts and time.monotonic() - self.expedited_starts[0] >= window:
+            self.expedited_starts.popleft()
+        if len(self.expedited_starts) < capacity_units * RETRIEVAL_SETTINGS['expedited_per_capacity_unit']:
+            return 0
+        return window - (time.monotonic() - self.expedited_starts[0])
+
+    def provisioned_capacity_units(self):
+        try:
+            response = self.client.list_provisioned_capacity(accountId=self.account_id)
+        except ClientError:
+            logger.exception("Couldn't list provisioned capacity, expedited retrievals run on demand.")
+            return 0
+        return len(response.get('ProvisionedCapacityList', []))
@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+SCHEDULER_SETTINGS = {
+    'max_workers': 8,
+    'category_limits': {
+        'upload': 2,
+        'download': 2,
+        'delete': 1,
+        'retrieval': 2,
+        'inventory': 1,
+        'sync': 1,
+        'jobs': 1
+    }
+}
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+
+    def __init__(self, task_id, category, priority, function, args, kwargs, title, on_done, on_error):
+        self.id = task_id
+        self.category = category
+        self.priority = priority
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.title = title
+        self.on_done = on_done
+        self.on_error = on_error
+        self.scheduler = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def report_progress(self, done, total):
+        # Long running work reports progress often, which doubles as the point where a cancellation takes effect.
+        if self.cancelled:
+            raise TaskCancelled(f'{self.title or self.category} was cancelled')
+        self.scheduler.progress.emit(self.id, done, total)
+
+
+class TaskScheduler(QObject):
+    progress = pyqtSignal(int, object, object)
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, object)
+    queue_changed = pyqtSignal(int, int)
+
+    def __init__(self, max_workers=None, category_limits=None, parent=None):
+        super(TaskScheduler, self).__init__(parent)
+        self.max_workers = max_workers or SCHEDULER_SETTINGS['max_workers']
+        self.category_limits = dict(SCHEDULER_SETTINGS['category_limits'], **(category_limits or {}))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.lock = threading.Lock()
+        self.queue = []
+        self.sequence = itertools.count()
+        self.task_ids = itertools.count(1)
+        self.tasks = {}
+        self.running = {}
+        self.finished.connect(self.on_task_finished)
+        self.failed.connect(self.on_task_failed)
+
+    def submit(self, category, function, *args, priority=PRIORITY_NORMAL, title='', on_done=None, on_error=None,
+               **kwargs):
+        task = Task(next(self.task_ids), category, priority, function, args, kwargs, title, on_done, on_error)
+        task.scheduler = self
+        with self.lock:
+            self.tasks[task.id] = task
+            heapq.heappush(self.queue, (priority, next(self.sequence), task))
+        self.dispatch()
+        return task
+
+    def cancel(self, task_id):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return
+            task.cancel()
+            queued = [entry for entry in self.queue if entry[2] is task]
+            for entry in queued:
+                self.queue.remove(entry)
+            heapq.heapify(self.queue)
+        if queued:
+            self.failed.emit(task.id, TaskCancelled(f'{task.title or task.category} was cancelled'))
+
+    def cancel_all(self):
+        for task_id in list(self.tasks):
+            self.cancel(task_id)
+
+    def dispatch(self):
+        with self.lock:
+            blocked = []
+            while self.queue and sum(self.running.values()) < self.max_workers:
+                entry = heapq.heappop(self.queue)
+                task = entry[2]
+                if self.running.get(task.category, 0) >= self.category_limits.get(task.category, self.max_workers):
+                    blocked.append(entry)
+                    continue
+                self.running[task.category] = self.running.get(task.category, 0) + 1
+                self.executor.submit(self.run, task)
+            for entry in blocked:
+                heapq.heappush(self.queue, entry)
+            running_count = sum(self.running.values())
+            queued_count = len(self.queue)
+        self.queue_changed.emit(running_count, queued_count)
+
+    def run(self, task):
+        try:
+            if task.cancelled:
+                raise TaskCancelled(f'{task.title or task.category} was cancelled')
+            result = task.function(task, *task.args, **task.kwargs)
+        except BaseException as error:
+            self.failed.emit(task.id, error)
+        else:
+            self.finished.emit(task.id, result)
+        finally:
+            with self.lock:
+                self.running[task.category] -= 1
+            self.dispatch()
+
+    def on_task_finished(self, task_id, result):
+        task = self.tasks.pop(task_id, None)
+        if task is not None and task.on_done is not None:
+            task.on_done(result)
+
+    def on_task_failed(self, task_id, error):
+        task = self.tasks.pop(task_id, None)
+        if task is None:
+            return
+        if isinstance(error, TaskCancelled):
+            logger.info("%s", error)
+        elif task.on_error is not None:
+            task.on_error(error)
+        else:
+            logger.error("Task %s (%s) failed: %s", task.id, task.title or task.category, error)
+
+    def shutdown(self):
+        self.cancel_all()
+        self.executor.shutdown(wait=False, cancel_futures=True)
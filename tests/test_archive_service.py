@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive_service
+import fake_backend
+from archive_catalog import ArchiveCatalog
+from archive_service import ArchiveService
+from aws_clients import CREDENTIALS
+from tree_hash import TreeHashMismatch
+
+
+class ArchiveServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.directory.name, 'storage'))
+        basedir_patch = mock.patch.object(archive_service, 'basedir', self.directory.name)
+        basedir_patch.start()
+        self.addCleanup(basedir_patch.stop)
+        self.backend = fake_backend.install({'seed': 5})
+        self.addCleanup(fake_backend.uninstall)
+        self.catalog = ArchiveCatalog(os.path.join(self.directory.name, 'storage/archives.db'))
+        self.addCleanup(self.catalog.close)
+        self.service = ArchiveService(self.catalog, pack_dir=os.path.join(self.directory.name, 'packs'),
+                                      upload_state_dir=os.path.join(self.directory.name, 'uploads'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_file(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as written_file:
+            written_file.write(data)
+        return path
+
+    def test_first_push_keeps_legacy_archives_json(self):
+        legacy_archives = [{'id': f'legacy-{i}', 'description': f'legacy {i}'} for i in range(3)]
+        self.backend.s3.put_object(Bucket=CREDENTIALS['bucket'], Key='archives.json',
+                                   Body=json.dumps(legacy_archives).encode('utf-8'))
+        # An upload finished before the archives table was ever opened pushes first.
+        self.catalog.add(self.service.upload_archive(self.write_file('new.txt', b'new'), 'new'))
+        self.service.sync_catalog_to_s3()
+        self.service.load_catalog_from_s3()
+
+        other_catalog = ArchiveCatalog(os.path.join(self.directory.name, 'other.db'))
+        self.addCleanup(other_catalog.close)
+        ArchiveService(other_catalog).load_catalog_from_s3()
+        self.assertEqual(self.catalog.count(), 4)
+        self.assertEqual(other_catalog.count(), 4)
+
+    def upload_pack(self, contents):
+        paths = [self.write_file(os.path.join('upload', name), data) for name, data in contents.items()]
+        archive_array = self.service.upload_pack(paths, 'pack', member_descriptions=list(contents))
+        self.catalog.add(archive_array)
+        return {archive['description']: archive['id'] for archive in archive_array if not archive.get('is_pack')}
+
+    def restore(self, archive_id):
+        self.service.request_retrievals([archive_id])
+        self.service.retrieval_scheduler.run(wait_for_deferred=False)
+        self.service.job_cache.refresh(full=True)
+        filename = self.service.output_filename(archive_id, directory=os.path.join(self.directory.name, 'output'))
+        return self.service.download_archive(archive_id, filename)
+
+    def test_restore_pack_members_with_the_same_name(self):
+        member_ids = self.upload_pack({'a/x.txt': b'a' * 3000, 'b/x.txt': b'b' * 5000})
+        for description, data in [('a/x.txt', b'a' * 3000), ('b/x.txt', b'b' * 5000)]:
+            filename = self.restore(member_ids[description])
+            self.assertEqual(filename, os.path.join(self.directory.name, 'output', description))
+            with open(filename, 'rb') as restored_file:
+                self.assertEqual(restored_file.read(), data)
+
+    def test_restore_empty_pack_member(self):
+        member_ids = self.upload_pack({'empty.txt': b'', 'full.txt': b'full'})
+        self.assertEqual(self.service.retrieval_status(member_ids['empty.txt']), (True, True))
+        self.assertEqual(self.service.request_retrievals([member_ids['empty.txt']]), (0, 0))
+        filename = self.restore(member_ids['empty.txt'])
+        self.assertEqual(os.stat(filename).st_size, 0)
+        self.assertEqual(self.backend.glacier.vault(CREDENTIALS['vault_name']).jobs, {})
+
+    def test_restore_rejects_corrupt_pack_member(self):
+        member_ids = self.upload_pack({'x.txt': b'x' * 3000})
+        vault = self.backend.glacier.vault(CREDENTIALS['vault_name'])
+        pack_id = self.catalog.get(member_ids['x.txt'])['pack_id']
+        vault.archives[pack_id]['data'] = vault.archives[pack_id]['data'].replace(b'x', b'y')
+        with self.assertRaises(TreeHashMismatch):
+            self.restore(member_ids['x.txt'])
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'output', 'x.txt')))
+
+    def test_upload_with_broken_inventory(self):
+        self.catalog.add([{'id': 'listed', 'size_in_bytes': 3}])
+        self.write_file('storage/inventory.json', b'{"VaultARN": "arn", "ArchiveList": [{"ArchiveId": "listed", ')
+        archive_array = self.service.upload_archive(self.write_file('new.txt', b'new'), 'new')
+        self.assertEqual(len(archive_array), 1)
+        self.assertIn(archive_array[0]['id'], self.backend.glacier.vault(CREDENTIALS['vault_name']).archives)
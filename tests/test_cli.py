@@ -0,0 +1,80 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cli
+import fake_backend
+from archive_catalog import ArchiveCatalog
+from archive_service import ArchiveService
+from aws_clients import CREDENTIALS
+from job_cache import JOB_CACHE_SETTINGS
+from pack_archive import PACK_SETTINGS
+from retrieval_scheduler import RETRIEVAL_SETTINGS
+
+
+class CliTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.backend = fake_backend.install({'seed': 11})
+        self.addCleanup(fake_backend.uninstall)
+        self.vault = self.backend.glacier.vault(CREDENTIALS['vault_name'])
+        self.catalog = ArchiveCatalog(os.path.join(self.directory.name, 'archives.db'))
+        self.addCleanup(self.catalog.close)
+        self.service = ArchiveService(self.catalog, pack_dir=os.path.join(self.directory.name, 'packs'),
+                                      upload_state_dir=os.path.join(self.directory.name, 'uploads'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_files(self, sizes):
+        source = os.path.join(self.directory.name, 'source')
+        os.makedirs(source, exist_ok=True)
+        for i, size in enumerate(sizes):
+            with open(os.path.join(source, f'file{i}'), 'wb') as source_file:
+                source_file.write(os.urandom(size))
+        return source
+
+    def run_command(self, run, argv):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return run(self.service, cli.parse_arguments(argv))
+
+    def test_upload_same_size_packs_from_one_directory(self):
+        source = self.write_files([1000] * 4)
+        with mock.patch.dict(PACK_SETTINGS, max_pack_size=2100):
+            report = self.run_command(cli.upload_dir, ['upload-dir', source, '--pack'])
+        self.assertEqual(report.failed, {})
+        self.assertEqual(report.done_count, 2)
+        self.assertEqual(len(self.vault.archives), 2)
+        self.assertEqual(sorted(archive['description'] for archive in self.catalog.all() if not archive['is_pack']),
+                         [f'file{i}' for i in range(4)])
+
+    def test_restore_waits_out_expedited_capacity(self):
+        source = self.write_files([100 + i for i in range(5)])
+        archive_ids = []
+        for file_name in sorted(os.listdir(source)):
+            archive_ids.extend(archive['id'] for archive in
+                               self.catalog.add(self.service.upload_archive(os.path.join(source, file_name))))
+        self.backend.settings['provisioned_capacity_units'] = 1
+        target = os.path.join(self.directory.name, 'restored')
+        result = {}
+        # One capacity unit starts three expedited jobs per window, the other two have to wait for the next window.
+        with mock.patch.dict(RETRIEVAL_SETTINGS, capacity_window=0.5, expedited_per_capacity_unit=3), \
+                mock.patch.dict(JOB_CACHE_SETTINGS, refresh_interval=0.05):
+            restore_thread = threading.Thread(target=lambda: result.update(report=self.run_command(
+                cli.restore, ['restore', *archive_ids, '--target', target, '--tier', 'Expedited', '--wait'])),
+                daemon=True)
+            restore_thread.start()
+            restore_thread.join(timeout=20)
+        self.assertFalse(restore_thread.is_alive())
+        self.assertEqual(result['report'].failed, {})
+        self.assertEqual(result['report'].done_count, 5)
+        self.assertEqual(len(os.listdir(target)), 5)
+        self.assertEqual(len(self.vault.jobs), 5)
@@ -0,0 +1,52 @@
+import io
+import os
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+
+import botocore.session
+from botocore.response import StreamingBody
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import MeteredStreamingBody, after_call, before_call, registry
+
+
+class MeteredStreamingBodyTest(unittest.TestCase):
+
+    def setUp(self):
+        registry.reset()
+        service_model = botocore.session.get_session().get_service_model('glacier')
+        self.model = service_model.operation_model('GetJobOutput')
+
+    def tearDown(self):
+        registry.reset()
+
+    def call(self, data):
+        context = {}
+        before_call(self.model, {}, context)
+        parsed = {'body': StreamingBody(io.BytesIO(data), len(data)), 'ResponseMetadata': {'RetryAttempts': 1}}
+        after_call(SimpleNamespace(status_code=200), parsed, self.model, context)
+        return parsed['body']
+
+    def test_records_download_when_read_to_the_end(self):
+        data = os.urandom(300000)
+        body = self.call(data)
+        self.assertIsInstance(body, MeteredStreamingBody)
+        self.assertEqual(registry.snapshot(), {})
+        time.sleep(0.05)
+        self.assertEqual(b''.join(body.iter_chunks(65536)), data)
+        stats = registry.snapshot()['glacier.GetJobOutput']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['bytes'], len(data))
+        self.assertGreaterEqual(stats['mean_latency_ms'], 50)
+
+    def test_records_partial_read_once_on_close(self):
+        body = self.call(b'x' * 1000)
+        body.read(100)
+        body.close()
+        body.close()
+        stats = registry.snapshot()['glacier.GetJobOutput']
+        self.assertEqual((stats['count'], stats['bytes']), (1, 100))
@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_backend import FakeBackend, FakeClient
+from metrics import registry
+from multipart_upload import MultipartUploader
+from tree_hash import MEGABYTE, TreeHash
+
+
+class MultipartUploaderTest(unittest.TestCase):
+    # The fake client only answers operations of the botocore Glacier model, so a misnamed call fails here too.
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'archive.bin')
+        with open(self.path, 'wb') as archive_file:
+            archive_file.write(os.urandom(6 * MEGABYTE + 12345))
+        self.backend = FakeBackend({'seed': 3})
+        self.client = self.backend.resource('glacier').meta.client
+        self.vault = self.backend.glacier.vault('vault')
+        self.uploader = MultipartUploader(self.client, 'vault', part_size=MEGABYTE, max_workers=2,
+                                          state_dir=os.path.join(self.directory.name, 'uploads'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assert_uploaded(self, archive_id):
+        with open(self.path, 'rb') as archive_file:
+            data = archive_file.read()
+        self.assertEqual(self.vault.archives[archive_id]['data'], data)
+        self.assertEqual(self.vault.archives[archive_id]['tree_hash'], TreeHash.from_file(self.path).hexdigest())
+        self.assertEqual(self.vault.uploads, {})
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, 'uploads')), [])
+
+    def test_upload(self):
+        self.assertIsInstance(self.client, FakeClient)
+        self.assert_uploaded(self.uploader.upload(self.path, 'archive', tree_hash=TreeHash.from_file(self.path)))
+
+    def test_upload_hashes_parts_without_tree_hash(self):
+        self.assert_uploaded(self.uploader.upload(self.path, 'archive'))
+
+    def test_resume_after_failed_part(self):
+        self.backend.settings.update(error_rate=0.5, error_operations=['UploadMultipartPart'])
+        with self.assertRaises(ClientError):
+            self.uploader.upload(self.path, 'archive')
+        self.assertEqual(len(self.vault.uploads), 1)
+        upload = next(iter(self.vault.uploads.values()))
+        acknowledged_parts = set(upload['parts'])
+
+        self.backend.settings.update(error_rate=0.0)
+        registry.reset()
+        archive_id = self.uploader.upload(self.path, 'archive')
+        self.assert_uploaded(archive_id)
+        # The upload resumes instead of starting over, and parts acknowledged before the failure are not sent again.
+        operations = registry.snapshot()
+        self.assertNotIn('glacier.InitiateMultipartUpload', operations)
+        self.assertEqual(operations['glacier.ListParts']['count'], 1)
+        self.assertEqual(operations['glacier.UploadMultipartPart']['count'], 7 - len(acknowledged_parts))
+
+
+if __name__ == '__main__':
+    unittest.main()
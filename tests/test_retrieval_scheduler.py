@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive_catalog import ArchiveCatalog
+from fake_backend import FakeBackend
+from job_cache import RetrievalJobCache
+from retrieval_scheduler import RetrievalScheduler
+
+
+class RetrievalSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.backend = FakeBackend({'seed': 7})
+        self.client = self.backend.resource('glacier').meta.client
+        self.vault = self.backend.glacier.vault('vault')
+        self.catalog = ArchiveCatalog(os.path.join(self.directory.name, 'archives.db'))
+        self.job_cache = RetrievalJobCache(self.client, 'vault')
+        self.scheduler = RetrievalScheduler(self.client, 'vault', '-', self.catalog, self.job_cache)
+
+    def tearDown(self):
+        self.catalog.close()
+        self.directory.cleanup()
+
+    def add_archive(self, data):
+        return self.backend.glacier.add_archive(self.vault, data, 'archive')['archiveId']
+
+    def test_waiting_run_wakes_up_for_new_requests(self):
+        deferred_id = self.add_archive(b'deferred')
+        self.catalog.put_retrievals([{'archive_id': deferred_id, 'byte_range': None, 'tier': 'Standard',
+                                      'status': 'queued', 'requested_at': time.time(),
+                                      'not_before': time.time() + 60, 'attempts': 1, 'error': None}])
+        cancel_event = threading.Event()
+        run_thread = threading.Thread(target=self.scheduler.run, kwargs={'cancel_event': cancel_event})
+        run_thread.start()
+        try:
+            # Lets the run reach its wait for the deferred request before anything new is queued.
+            time.sleep(0.2)
+            new_id = self.add_archive(b'new')
+            self.scheduler.enqueue([(new_id, None)])
+            deadline = time.monotonic() + 1
+            while self.job_cache.get(new_id) is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertIsNotNone(self.job_cache.get(new_id))
+            self.assertIsNone(self.job_cache.get(deferred_id))
+        finally:
+            cancel_event.set()
+            run_thread.join()
@@ -0,0 +1,95 @@
+import hashlib
+import math
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+MEGABYTE = 1024 * 1024
+
+# Number of 1 MiB leaves hashed by one worker task, large enough to keep the pool overhead negligible.
+LEAVES_PER_TASK = 16
+
+
+class TreeHashMismatch(Exception):
+    pass
+
+
+def combine_tree_hashes(hashes):
+    hashes = list(hashes)
+    if not hashes:
+        return hashlib.sha256(b'').digest()
+    while len(hashes) > 1:
+        combined = []
+        for i in range(0, len(hashes), 2):
+            if i + 1 < len(hashes):
+                combined.append(hashlib.sha256(hashes[i] + hashes[i + 1]).digest())
+            else:
+                combined.append(hashes[i])
+        hashes = combined
+    return hashes[0]
+
+
+def hash_leaves(buffer, first_leaf, last_leaf):
+    return [hashlib.sha256(buffer[i * MEGABYTE:(i + 1) * MEGABYTE]).digest() for i in range(first_leaf, last_leaf)]
+
+
+class TreeHash:
+
+    def __init__(self, leaf_hashes, size):
+        self.leaf_hashes = leaf_hashes
+        self.size = size
+        self.subtree_hashes = {}
+
+    @classmethod
+    def from_buffer(cls, buffer, workers=None):
+        # hashlib releases the GIL on large buffers, so leaves are hashed in parallel by plain threads.
+        size = len(buffer)
+        if size == 0:
+            return cls([hashlib.sha256(b'').digest()], 0)
+        leaf_count = math.ceil(size / MEGABYTE)
+        with memoryview(buffer) as view:
+            if leaf_count <= LEAVES_PER_TASK:
+                return cls(hash_leaves(view, 0, leaf_count), size)
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+                batches = executor.map(lambda first: hash_leaves(view, first, min(first + LEAVES_PER_TASK, leaf_count)),
+                                       range(0, leaf_count, LEAVES_PER_TASK))
+                leaf_hashes = [leaf_hash for batch in batches for leaf_hash in batch]
+        return cls(leaf_hashes, size)
+
+    @classmethod
+    def from_file(cls, file_path, workers=None):
+        with open(file_path, 'rb') as hashed_file:
+            if os.fstat(hashed_file.fileno()).st_size == 0:
+                return cls.from_buffer(b'')
+            with mmap.mmap(hashed_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                return cls.from_buffer(mapped_file, workers)
+
+    def digest(self):
+        return self.range_digest(0, self.size)
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def range_digest(self, start, length):
+        # Glacier only returns and accepts tree hashes for ranges that start on a 1 MiB boundary.
+        if start % MEGABYTE:
+            raise ValueError(f'Range start {start} is not aligned to 1 MiB')
+        if (start, length) not in self.subtree_hashes:
+            first_leaf = start // MEGABYTE
+            last_leaf = max(first_leaf + 1, math.ceil((start + length) / MEGABYTE))
+            self.subtree_hashes[(start, length)] = combine_tree_hashes(self.leaf_hashes[first_leaf:last_leaf])
+        return self.subtree_hashes[(start, length)]
+
+    def range_hexdigest(self, start, length):
+        return self.range_digest(start, length).hex()
+
+    def part_hexdigests(self, part_size):
+        return [self.range_hexdigest(start, min(part_size, self.size - start)) for start in range(0, self.size, part_size)]
+
+    def verify(self, expected_checksum, start=0, length=None):
+        if length is None:
+            length = self.size - start
+        actual_checksum = self.range_hexdigest(start, length)
+        if actual_checksum != expected_checksum:
+            raise TreeHashMismatch(f'Tree hash of bytes {start}-{start + length - 1} is {actual_checksum}, '
+                                   f'expected {expected_checksum}')